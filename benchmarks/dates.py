@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# coding: utf-8
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from siterefactorlib import dates  # noqa: E402
+
+
+def sample_dates(count):
+    # Dates as they appear in [[!meta date]] directives: mostly ISO-8601, with
+    # and without timezone, and a few in other formats
+    start = datetime.datetime(2005, 1, 1, 10, 0)
+    res = []
+    for i in range(count):
+        date = start + datetime.timedelta(days=i, minutes=i * 7)
+        if i % 10 == 9:
+            res.append(date.strftime("%a, %d %b %Y %H:%M"))
+        elif i % 2:
+            res.append(date.strftime("%Y-%m-%d %H:%M"))
+        else:
+            res.append(date.strftime("%Y-%m-%dT%H:%M:%S+01:00"))
+    return res
+
+
+def report(name, seconds, count):
+    print("{:<32} {:8.2f}µs per page".format(name, seconds * 1000000 / count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time parsing and formatting page dates.")
+    parser.add_argument("-n", "--pages", type=int, default=5000, help="number of pages (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs of each measure, keeping the best")
+    args = parser.parse_args()
+
+    strings = sample_dates(args.pages)
+
+    def best(func):
+        return min(timeit.repeat(func, number=1, repeat=args.repeat))
+
+    from dateutil.parser import parse as dateutil_parse
+    site_tz = dates.site_timezone()
+
+    def parse_dateutil():
+        for s in strings:
+            res = dateutil_parse(s)
+            if res.tzinfo is None:
+                site_tz.localize(res)
+
+    def parse():
+        for s in strings:
+            dates.parse(s)
+
+    report("parse (dateutil)", best(parse_dateutil), len(strings))
+    report("parse (dates.parse)", best(parse), len(strings))
+
+    parsed = [dates.parse(s) for s in strings]
+    # Sites often have many pages with the same date, as with dates taken
+    # from file times after a checkout
+    repeated = [parsed[i % 50] for i in range(len(parsed))]
+
+    for name, func in (("format_ikiwiki", dates.format_ikiwiki),
+                       ("format_nikola", dates.format_nikola),
+                       ("format_pelican", dates.format_pelican)):
+        def uncached():
+            for d in repeated:
+                func.__wrapped__(d)
+
+        def cached():
+            func.cache_clear()
+            for d in repeated:
+                func(d)
+
+        report(name + " (uncached)", best(uncached), len(repeated))
+        report(name + " (cached)", best(cached), len(repeated))
+
+
+if __name__ == "__main__":
+    main()
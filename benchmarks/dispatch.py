@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# coding: utf-8
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from siterefactorlib import content  # noqa: E402
+from siterefactorlib.core import BodyWriter, type_dispatch  # noqa: E402
+
+
+def sample_body(count):
+    # A body made of the most common elements of parsed pages
+    res = []
+    for i in range(count // 3):
+        res.append(content.Text(None, i, "Some text of line {}".format(i)))
+        res.append(content.EOL(None, i))
+        res.append(content.Line(None, i, "    code line {}".format(i)))
+    return res
+
+
+class PageWriter:
+    # Writer with a method for each page type
+    def write_markdown(self, page):
+        pass
+
+    def write_static(self, page):
+        pass
+
+    def write_alias(self, page):
+        pass
+
+
+class Page:
+    def __init__(self, type):
+        self.TYPE = type
+
+
+def report(name, seconds, count):
+    print("{:<36} {:8.1f}ns per item".format(name, seconds * 1000000000 / count))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Compare dispatch tables with getattr lookups in body and page writers.")
+    parser.add_argument("srcdir", nargs="?", help="site whose page bodies are used (default: a synthetic body)")
+    parser.add_argument("-n", "--elements", type=int, default=30000,
+                        help="number of elements of the synthetic body (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs of each measure, keeping the best")
+    args = parser.parse_args()
+
+    if args.srcdir:
+        from siterefactorlib.core import load_site
+        site = load_site(os.path.abspath(args.srcdir))
+        body = [el for page in site.pages.values() if page.TYPE == "markdown" for el in page.body]
+        pages = list(site.pages.values())
+    else:
+        body = sample_body(args.elements)
+        pages = [Page(("markdown", "static", "alias")[i % 3]) for i in range(args.elements)]
+
+    def best(func):
+        return min(timeit.repeat(func, number=1, repeat=args.repeat))
+
+    writer = BodyWriter()
+
+    def elements_getattr():
+        writer.chunks = []
+        for el in body:
+            getattr(writer, "generate_" + el.__class__.__name__.lower())(el)
+
+    def elements_table():
+        writer.chunks = []
+        writer.read_body(body)
+
+    report("body elements (getattr)", best(elements_getattr), len(body))
+    report("body elements (dispatch_table)", best(elements_table), len(body))
+
+    page_writer = PageWriter()
+
+    def pages_getattr():
+        for page in pages:
+            getattr(page_writer, "write_" + page.TYPE)(page)
+
+    def pages_table():
+        write = type_dispatch(page_writer, "write_")
+        for page in pages:
+            write[page.TYPE](page)
+
+    report("page types (getattr)", best(pages_getattr), len(pages))
+    report("page types (type_dispatch)", best(pages_table), len(pages))
+
+
+if __name__ == "__main__":
+    main()
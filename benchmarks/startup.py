@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+# coding: utf-8
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Commands whose startup time is measured: they should not load the modules
+# needed only to render or convert pages
+COMMANDS = [
+    ("python", [sys.executable, "-c", "pass"]),
+    ("import core", [sys.executable, "-c", "import siterefactorlib.core"]),
+    ("import web", [sys.executable, "-c", "import siterefactorlib.web"]),
+    ("siterefactor --help", [sys.executable, os.path.join(ROOT, "siterefactor"), "--help"]),
+    ("siterefactor-deploy --help", [sys.executable, os.path.join(ROOT, "siterefactor-deploy"), "--help"]),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the startup of the siterefactor commands.")
+    parser.add_argument("-r", "--repeat", type=int, default=10, help="runs of each command, keeping the best")
+    args = parser.parse_args()
+
+    for name, cmd in COMMANDS:
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        print("{:<32} {:8.1f}ms".format(name, min(times) * 1000))
+
+
+if __name__ == "__main__":
+    main()
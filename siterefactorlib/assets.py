@@ -0,0 +1,66 @@
+# coding: utf-8
+from .manifest import file_hash
+import hashlib
+import os
+
+# Cache-Control header for fingerprinted files, whose contents never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class Assets:
+    # Content hashes of the files in the static directory, used to write
+    # copies with the hash in their name, which can be cached forever
+    def __init__(self, root, cache):
+        # Static directory
+        self.root = root
+
+        # relpath -> [size, mtime_ns, sha256] from the previous build
+        self.old_files = cache
+
+        # relpath -> [size, mtime_ns, sha256] for this build
+        self.files = {}
+
+        self.count_hashed = 0
+
+    def scan(self):
+        # Hash the static files, reusing the hashes of files whose size and
+        # mtime did not change
+        if not os.path.isdir(self.root):
+            return
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for f in filenames:
+                abspath = os.path.join(dirpath, f)
+                relpath = os.path.relpath(abspath, self.root)
+                st = os.stat(abspath)
+                cached = self.old_files.get(relpath)
+                if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                    digest = cached[2]
+                else:
+                    digest = file_hash(abspath)
+                    self.count_hashed += 1
+                self.files[relpath] = [st.st_size, st.st_mtime_ns, digest]
+
+    def fingerprinted(self, relpath):
+        # Return the relpath of the fingerprinted copy of a static file, or
+        # relpath itself if it is not a static file
+        info = self.files.get(relpath)
+        if info is None:
+            return relpath
+        base, ext = os.path.splitext(relpath)
+        return "{}.{}{}".format(base, info[2][:12], ext)
+
+    @property
+    def signature(self):
+        # Hash of all the static files, changing when any of them changes
+        h = hashlib.sha256()
+        for relpath, info in sorted(self.files.items()):
+            h.update("{}\0{}\0".format(relpath, info[2]).encode())
+        return h.hexdigest()
+
+    def headers(self):
+        # Return a _headers file marking the fingerprinted copies as immutable
+        lines = []
+        for relpath in sorted(self.files):
+            lines.append("/" + self.fingerprinted(relpath))
+            lines.append("  Cache-Control: " + IMMUTABLE)
+        return "\n".join(lines) + "\n"
@@ -1,6 +1,6 @@
 # coding: utf-8
 
-from .core import BodyWriter, MarkdownPage
+from .core import BodyWriter, MarkdownPage, type_dispatch
 import os
 import shutil
 import json
@@ -16,10 +16,11 @@ class BodyChecker(BodyWriter):
 class Checker:
     def write(self, site):
         counts = Counter()
+        check = type_dispatch(self, "check_")
         for page in site.pages.values():
             # TODO: run a checker on the parsed body
             counts[page.TYPE] += 1
-            getattr(self, "check_" + page.TYPE)(page)
+            check[page.TYPE](page)
 
         for type, count in sorted(counts.items()):
             print("{} {} pages".format(count, type))
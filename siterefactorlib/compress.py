@@ -0,0 +1,87 @@
+# coding: utf-8
+from concurrent.futures import ProcessPoolExecutor
+from .manifest import MANIFEST_NAME
+import gzip
+import hashlib
+import os
+import logging
+
+log = logging.getLogger()
+
+# Extensions of files worth compressing
+COMPRESSIBLE = frozenset((
+    ".html", ".css", ".js", ".json", ".svg", ".xml", ".atom", ".rss", ".txt",
+    ".md", ".map", ".ico", ".ttf", ".otf", ".eot",
+))
+
+# Extensions of the precompressed siblings
+SIBLINGS = (".gz", ".br")
+
+
+def is_sibling(relpath):
+    # Check if relpath is a precompressed sibling of a compressible file
+    base, ext = os.path.splitext(relpath)
+    return ext in SIBLINGS and os.path.splitext(base)[1] in COMPRESSIBLE
+
+
+def _up_to_date(sibling, st_src, digest, decompress):
+    # Check if sibling is newer than the source and contains it
+    try:
+        if os.stat(sibling).st_mtime_ns < st_src.st_mtime_ns:
+            return False
+        with open(sibling, "rb") as fd:
+            return hashlib.sha256(decompress(fd.read())).digest() == digest
+    except (OSError, ValueError):
+        return False
+
+
+def _write(dst, data):
+    tmp = dst + ".tmp"
+    with open(tmp, "wb") as out:
+        out.write(data)
+    os.replace(tmp, dst)
+
+
+def compress_file(abspath):
+    # Create or refresh the precompressed siblings of a file, returning the
+    # number of siblings written
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    st = os.stat(abspath)
+    with open(abspath, "rb") as fd:
+        data = fd.read()
+    digest = hashlib.sha256(data).digest()
+
+    written = 0
+    dst = abspath + ".gz"
+    if not _up_to_date(dst, st, digest, gzip.decompress):
+        # Use a fixed mtime, so that the output is reproducible
+        _write(dst, gzip.compress(data, compresslevel=9, mtime=0))
+        written += 1
+
+    if brotli is not None:
+        dst = abspath + ".br"
+        if not _up_to_date(dst, st, digest, brotli.decompress):
+            _write(dst, brotli.compress(data))
+            written += 1
+
+    return written
+
+
+def precompress(root, workers=None):
+    # Write .gz (and .br, if brotli is available) siblings for all
+    # compressible files in root, using a process pool
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for f in filenames:
+            if f != MANIFEST_NAME and os.path.splitext(f)[1] in COMPRESSIBLE:
+                sources.append(os.path.join(dirpath, f))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        written = sum(executor.map(compress_file, sources, chunksize=16))
+
+    log.info("Precompressed %d files, %d siblings written", len(sources), written)
+    return written
@@ -62,8 +62,7 @@ class InternalLink(Base):
         self.text = text
         self.target = self.page.resolve_link(target)
         if self.target is None:
-            log.warn("%s:%d: link %s cannot be resolved to a known resource",
-                     self.page.relpath, self.lineno, target)
+            self.page.site.diagnostics.add("unresolved-link", self.page.relpath, self.lineno, target)
 
 class InlineImage(Base):
     def __init__(self, page, lineno, fname, alt):
@@ -71,8 +70,7 @@ class InlineImage(Base):
         self.text = alt
         self.target = self.page.resolve_link(fname)
         if self.target is None:
-            log.warn("%s:%d: image %s cannot be resolved to a known resource",
-                     self.page.relpath, self.lineno, fname)
+            self.page.site.diagnostics.add("unresolved-image", self.page.relpath, self.lineno, fname)
 
 
 class Directive(Base):
@@ -1,15 +1,19 @@
 # coding: utf-8
 import os
 import re
-import datetime
 import json
+import pickle
 import logging
-import pytz
 from . import content
+from . import dates
+from .query import SiteIndex, Query
+from .diagnostics import Diagnostics
 
 log = logging.getLogger()
 
-tz_local = pytz.timezone("Europe/Rome")
+# Version of the parsed site cache format, to change when the contents of Site
+# and pages change
+CACHE_VERSION = 2
 
 class Ctimes:
     def __init__(self, fname):
@@ -37,7 +41,7 @@ class Page:
 
         # Page date
         if ctime is not None:
-            self.date = pytz.utc.localize(datetime.datetime.utcfromtimestamp(ctime))
+            self.date = dates.from_timestamp(ctime)
         else:
             self.date = None
 
@@ -52,18 +56,7 @@ class Page:
 
     @property
     def date_as_iso8601(self):
-        from dateutil.tz import tzlocal
-        tz = tzlocal()
-        ts = self.date.astimezone(tz)
-        offset = tz.utcoffset(ts)
-        offset_sec = (offset.days * 24 * 3600 + offset.seconds)
-        offset_hrs = offset_sec // 3600
-        offset_min = offset_sec % 3600
-        if offset:
-            tz_str = '{0:+03d}:{1:02d}'.format(offset_hrs, offset_min // 60)
-        else:
-            tz_str = 'Z'
-        return ts.strftime("%Y-%m-%d %H:%M:%S") + tz_str
+        return dates.format_ikiwiki(self.date)
 
     @property
     def relpath_without_extension(self):
@@ -95,21 +88,35 @@ class Page:
 class MarkdownPage(Page):
     TYPE = "markdown"
 
+    # Rules used to match metadata lines, whole body lines and ikiwiki
+    # directives. They are compiled once per class, the first time a page is
+    # parsed, by compile_rules()
+    meta_line_rules = None
+    body_line_rules = None
+    body_directive_rules = None
+    re_directive = None
+
     def __init__(self, site, relpath, ctime=None):
         super().__init__(site, relpath, ctime)
 
         # Sequence of content.* objects from the parsed page contents
         self.body = []
 
+        # True if the date comes from a [[!meta date]] directive, and not from
+        # ctime information or the file mtime
+        self.date_in_source = False
+
+    @classmethod
+    def compile_rules(cls):
         # Rules used to match metadata lines
-        self.meta_line_rules = [
-            (re.compile(r"^#\s*(?P<title>.+)"), self.parse_title),
-            (re.compile(r"^\[\[!tag (?P<tags>[^\]]+)\]\]"), self.parse_tags),
-            (re.compile(r'^\[\[!meta date="(?P<date>[^"]+)"\]\]'), self.parse_date),
+        cls.meta_line_rules = [
+            (re.compile(r"^#\s*(?P<title>.+)"), cls.parse_title),
+            (re.compile(r"^\[\[!tag (?P<tags>[^\]]+)\]\]"), cls.parse_tags),
+            (re.compile(r'^\[\[!meta date="(?P<date>[^"]+)"\]\]'), cls.parse_date),
         ]
 
         # Rules used to match whole lines
-        self.body_line_rules = [
+        cls.body_line_rules = [
             (re.compile(r'^\[\[!format (?P<lang>\S+) """'), content.CodeBegin),
             (re.compile(r"^\[\[!format (?P<lang>\S+) '''"), content.CodeBegin),
             (re.compile(r'^"""\]\]'), content.CodeEnd),
@@ -118,16 +125,19 @@ class MarkdownPage(Page):
         ]
 
         # Rules used to parse directives
-        self.body_directive_rules = [
+        cls.body_directive_rules = [
             (re.compile(r'!img (?P<fname>\S+) alt="(?P<alt>[^"]+)"'), content.InlineImage),
             (re.compile(r"(?P<text>[^|]+)\|(?P<target>[^\]]+)"), content.InternalLink),
         ]
 
+        # Regular expression used to split lines looking for ikiwiki directives
+        cls.re_directive = re.compile(r"\[\[([^\]]+)\]\]")
+
     def scan(self):
         # Read the contents
         src = os.path.join(self.site.root, self.relpath)
         if self.date is None:
-            self.date = pytz.utc.localize(datetime.datetime.utcfromtimestamp(os.path.getmtime(src)))
+            self.date = dates.from_timestamp(os.path.getmtime(src))
         with open(src, "rt") as fd:
             self.parse_body(fd)
 
@@ -156,14 +166,14 @@ class MarkdownPage(Page):
         return None
 
     def parse_date(self, lineno, line, date, **kw):
-        import dateutil
-        from dateutil.parser import parse
-        self.date = dateutil.parser.parse(date)
-        if self.date.tzinfo is None:
-            self.date = tz_local.localize(self.date)
+        self.date = dates.parse(date)
+        self.date_in_source = True
         return None
 
     def parse_body(self, fd):
+        if self.meta_line_rules is None:
+            self.compile_rules()
+
         for lineno, line in enumerate(fd, 1):
             line = line.rstrip()
 
@@ -171,7 +181,7 @@ class MarkdownPage(Page):
             for regex, func in self.meta_line_rules:
                 mo = regex.match(line)
                 if mo:
-                    line = func(lineno, line, **mo.groupdict())
+                    line = func(self, lineno, line, **mo.groupdict())
                     break
 
             if line is not None:
@@ -186,8 +196,7 @@ class MarkdownPage(Page):
                 return
 
         # Split the line looking for ikiwiki directives
-        re_directive = re.compile(r"\[\[([^\]]+)\]\]")
-        parts = re_directive.split(line)
+        parts = self.re_directive.split(line)
         if len(parts) == 1:
             self.body.append(content.Line(self, lineno, line))
             return
@@ -252,17 +261,69 @@ class Site:
         # Description of tags
         self.tag_descriptions = {}
 
+        # Secondary indexes on pages
+        self.index = SiteIndex()
+
+        # Problems found in the site
+        self.diagnostics = Diagnostics()
+
+        # Modification times of the files and directories that have been read,
+        # by absolute pathname
+        self.sources = {}
+
+        # Cache of relative paths for links: (source directory, target
+        # relpath) -> path of target relative to the source directory. Values
+        # only depend on the key, so entries never need to be invalidated
+        self.link_paths = {}
+
+    def load(self, extrainfo=None):
+        # Read and scan all the site
+        if extrainfo:
+            self.load_extrainfo(extrainfo)
+        self.read_blog()
+        self.read_years()
+        self.read_talks()
+        self.read_tag_descriptions("tags")
+        self.scan()
+
+    def save(self, pathname, extrainfo=None):
+        # Save the parsed site, to be reused by load_site
+        tmp = pathname + ".tmp"
+        with open(tmp, "wb") as out:
+            pickle.dump((CACHE_VERSION, self.root, extrainfo, self), out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, pathname)
+
+    def track_source(self, abspath):
+        self.sources[abspath] = os.stat(abspath).st_mtime_ns
+
+    def changed_sources(self):
+        # Return the pathnames of the files and directories that changed since
+        # they were read. Since directories are tracked too, this also catches
+        # added and removed files
+        res = []
+        for pathname, mtime in self.sources.items():
+            try:
+                if os.stat(pathname).st_mtime_ns == mtime:
+                    continue
+            except FileNotFoundError:
+                pass
+            res.append(pathname)
+        return res
+
     def load_extrainfo(self, pathname):
+        self.track_source(pathname)
         self.ctimes = Ctimes(pathname)
 
     def read_years(self):
-        for d in os.listdir(self.root):
+        self.track_source(self.root)
+        for d in sorted(os.listdir(self.root)):
             if not re.match(r"^\d{4}$", d): continue
             self.read_tree(d)
 
     def read_blog(self):
         blogroot = os.path.join(self.root, "blog")
-        for d in os.listdir(blogroot):
+        self.track_source(blogroot)
+        for d in sorted(os.listdir(blogroot)):
             if not re.match(r"^\d{4}$", d): continue
             self.read_tree(os.path.join("blog", d))
 
@@ -274,7 +335,8 @@ class Site:
     def read_tree(self, relpath):
         log.info("Loading directory %s", relpath)
         abspath = os.path.join(self.root, relpath)
-        for f in os.listdir(abspath):
+        self.track_source(abspath)
+        for f in sorted(os.listdir(abspath)):
             absf = os.path.join(abspath, f)
             if os.path.isdir(absf):
                 self.read_tree(os.path.join(relpath, f))
@@ -286,18 +348,20 @@ class Site:
     def read_tag_descriptions(self, relpath):
         log.info("Loading tag info from %s", relpath)
         abspath = os.path.join(self.root, relpath)
-        for f in os.listdir(abspath):
+        self.track_source(abspath)
+        for f in sorted(os.listdir(abspath)):
             # Skip tag index
             if f == "index.mdwn": continue
             if not f.endswith(".mdwn"): continue
             desc = []
             tag = os.path.splitext(f)[0]
+            self.track_source(os.path.join(abspath, f))
             with open(os.path.join(abspath, f), "rt") as fd:
-                for line in fd:
+                for lineno, line in enumerate(fd, 1):
                     line = line.rstrip()
                     if line.startswith("[[!"):
                         if re.match(r'\[\[!inline pages="link\(tags/{tag}\)" show="\d+"\]\]'.format(tag=tag), line): continue
-                        log.warn("%s: found unsupported tag lookup: %s", os.path.join(relpath, f), line)
+                        self.diagnostics.add("unsupported-tag-lookup", os.path.join(relpath, f), lineno, line)
                     else:
                         desc.append(line)
 
@@ -317,6 +381,7 @@ class Site:
 
     def read_page(self, relpath):
         log.info("Loading page %s", relpath)
+        self.track_source(os.path.join(self.root, relpath))
         with open(os.path.join(self.root, relpath), "rt") as fd:
             content = fd.read().strip()
         # Catch alias pages
@@ -327,34 +392,81 @@ class Site:
         else:
             page = self._instantiate(MarkdownPage, relpath)
             self.pages[relpath] = page
+            self.index.add(page)
 
     def read_static(self, relpath):
         log.info("Loading static file %s", relpath)
+        self.track_source(os.path.join(self.root, relpath))
         static = self._instantiate(StaticFile, relpath)
         self.pages[relpath] = static
+        self.index.add(static)
 
     def relocate(self, page, dest_relpath):
         log.info("Relocating %s to %s", page.relpath, dest_relpath)
         if dest_relpath in self.pages:
-            log.warn("Cannot relocate %s to existing page %s", page.relpath, dest_relpath)
+            self.diagnostics.add("relocate-conflict", page.relpath, None, dest_relpath)
             return
+        self.index.remove(page)
         self.pages[dest_relpath] = page
         page.aliases.append(page.relpath)
         page.relpath = dest_relpath
+        self.index.add(page)
+        # Cached link paths stay valid: they only depend on their key, and
+        # links from and to the new location use new keys
+
+    def link_path(self, src_relpath, target_relpath):
+        # Return the path of target_relpath relative to the directory of the
+        # page at src_relpath
+        key = (os.path.dirname(src_relpath), target_relpath)
+        res = self.link_paths.get(key)
+        if res is None:
+            res = self.link_paths[key] = os.path.relpath(target_relpath, key[0])
+        return res
 
     def scan(self):
         # Remove alias pages from self.pages, adding them instead as aliases to
-        # the Page they refer to
+        # the Page they refer to. Chains of alias pages are followed, so that
+        # each alias leads to its final page in one step
         for p in self.alias_pages.values():
-            dest_relpath = p.resolve_link_relpath(p.dest)
-            dest = self.pages.get(dest_relpath, None)
+            alias = p
+            seen = set()
+            while True:
+                seen.add(alias.relpath)
+                dest_relpath = alias.resolve_link_relpath(alias.dest)
+                dest = self.pages.get(dest_relpath, None)
+                if dest is not None or dest_relpath not in self.alias_pages or dest_relpath in seen:
+                    break
+                alias = self.alias_pages[dest_relpath]
             if dest is None:
-                log.warn("%s: redirects to missing page %s", p.relpath, p.dest)
+                self.diagnostics.add("missing-redirect", p.relpath, None, p.dest)
             else:
                 dest.aliases.append(p.relpath)
 
         for page in self.pages.values():
+            # Scanning sets date, tags and links, so reindex the page
+            self.index.remove(page)
             page.scan()
+            self.index.add(page)
+
+    @property
+    def tag_index(self):
+        # Pages for each tag, newest first
+        return self.index.by_tag
+
+    def query(self):
+        # Start a query on the site pages, see query.Query
+        return Query(self.index)
+
+
+def type_dispatch(obj, prefix):
+    # Map page TYPEs to the methods of obj named prefix + TYPE, so that writers
+    # can resolve them once instead of for every page
+    res = {}
+    for cls in (MarkdownPage, AliasPage, StaticFile):
+        func = getattr(obj, prefix + cls.TYPE, None)
+        if func is not None:
+            res[cls.TYPE] = func
+    return res
 
 
 class BodyWriter:
@@ -370,9 +482,30 @@ class BodyWriter:
                 return False
         return True
 
+    @classmethod
+    def dispatch_table(cls):
+        # Map content element classes to the generate_* functions of this
+        # class. The table is built once per class
+        table = cls.__dict__.get("_dispatch")
+        if table is None:
+            table = {}
+            for el_cls in content.Base.__subclasses__():
+                table[el_cls] = getattr(cls, "generate_" + el_cls.__name__.lower())
+            cls._dispatch = table
+        return table
+
     def read(self, page):
-        for el in page.body:
-            getattr(self, "generate_" + el.__class__.__name__.lower())(el)
+        self.read_body(page.body)
+
+    def read_body(self, body):
+        # Generate output for a whole sequence of content elements
+        table = self.dispatch_table()
+        for el in body:
+            try:
+                func = table[el.__class__]
+            except KeyError:
+                func = table[el.__class__] = getattr(self.__class__, "generate_" + el.__class__.__name__.lower())
+            func(self, el)
 
     def generate_line(self, el):
         self.chunks.append(el.line + "\n")
@@ -385,7 +518,7 @@ class BodyWriter:
 
     def generate_ikiwikimap(self, el):
         if el.lineno != 1:
-            log.warn("%s:%s: found map tag not in first line", el.page.relpath, el.lineno)
+            el.page.site.diagnostics.add("misplaced-map", el.page.relpath, el.lineno)
 
     def generate_text(self, el):
         self.chunks.append(el.text)
@@ -400,4 +533,34 @@ class BodyWriter:
         pass
 
     def generate_directive(self, el):
-        log.warn("%s:%s: found unsupported custom tag [[%s]]", el.page.relpath, el.lineno, el.content)
+        el.page.site.diagnostics.add("unsupported-directive", el.page.relpath, el.lineno, el.content)
+
+
+def load_site(root, extrainfo=None, cache=None):
+    # Load and scan a site. If cache is given, it is the pathname of a parsed
+    # site saved by a previous run, which is used instead of parsing if none
+    # of the files and directories it was read from changed; otherwise it is
+    # rewritten with the newly parsed site
+    if cache is not None:
+        try:
+            with open(cache, "rb") as fd:
+                version, cached_root, cached_extrainfo, site = pickle.load(fd)
+        except FileNotFoundError:
+            site = None
+        except Exception as e:
+            log.info("%s: cannot load parsed site: %s", cache, e)
+            site = None
+        else:
+            if version != CACHE_VERSION or cached_root != root or cached_extrainfo != extrainfo:
+                site = None
+            elif site.changed_sources():
+                site = None
+        if site is not None:
+            log.info("%s: reusing parsed site", cache)
+            return site
+
+    site = Site(root)
+    site.load(extrainfo)
+    if cache is not None:
+        site.save(cache, extrainfo)
+    return site
@@ -0,0 +1,225 @@
+# coding: utf-8
+from .core import Site, MarkdownPage, BodyWriter
+from .diagnostics import Diagnostics
+from . import content
+import inspect
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger()
+
+
+class RequestError(RuntimeError):
+    pass
+
+
+class ServeError(RuntimeError):
+    pass
+
+
+class SiteDaemon:
+    # Keep a Site loaded in memory, reloading it when its sources change, and
+    # answer queries about it. Requests can come from several threads, and
+    # are run one at a time
+
+    # Minimum number of seconds between checks for changed sources, since a
+    # check stats every file of the site
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, root, extrainfo=None):
+        self.root = root
+        self.extrainfo = extrainfo
+        self.site = None
+
+        # time.monotonic() of the last check for changed sources
+        self.checked = None
+
+        # target relpath -> set of relpaths of the pages linking to it
+        self.backlinks = None
+
+        # Held while running a request
+        self.lock = threading.Lock()
+
+    def reload(self):
+        # Return the site, loading it again if its sources changed
+        if self.site is not None and time.monotonic() - self.checked < self.CHECK_INTERVAL:
+            return self.site
+        if self.site is None or self.site.changed_sources():
+            log.info("Loading site %s", self.root)
+            self.site = Site(self.root)
+            self.site.load(self.extrainfo)
+            self.backlinks = None
+        self.checked = time.monotonic()
+        return self.site
+
+    def get_page(self, relpath):
+        site = self.reload()
+        page = site.pages.get(relpath)
+        if page is None:
+            raise RequestError("page {} not found".format(relpath))
+        return page
+
+    def index_backlinks(self):
+        if self.backlinks is None:
+            self.backlinks = {}
+            for page in self.site.pages.values():
+                if page.TYPE != "markdown": continue
+                for el in page.body:
+                    if isinstance(el, (content.InternalLink, content.InlineImage)) and el.target is not None:
+                        self.backlinks.setdefault(el.target.relpath, set()).add(page.relpath)
+        return self.backlinks
+
+    def do_resolve(self, page, target):
+        # Resolve a link as written in page
+        dest = self.get_page(page).resolve_link(target)
+        return dest.relpath if dest is not None else None
+
+    def do_render_page(self, page, format="ikiwiki"):
+        # Render the body of a page in the given format
+        page = self.get_page(page)
+        if page.TYPE != "markdown":
+            raise RequestError("page {} is not a markdown page".format(page.relpath))
+        if format == "ikiwiki":
+            from .ikiwiki import IkiwikiMarkdown as Writer
+        elif format == "ssite":
+            from .ssite import SSiteMarkdown as Writer
+        elif format == "hugo":
+            from .hugo import HugoMarkdown as Writer
+        elif format == "html":
+            from .web import Webpage as Writer
+        else:
+            raise RequestError("unsupported format {}".format(format))
+        writer = Writer()
+        writer.read(page)
+        text = "".join(writer.chunks)
+        if format == "html":
+            from markdown import Markdown
+            text = Markdown(
+                extensions=["markdown.extensions.extra", "markdown.extensions.codehilite"],
+                output_format="html5").convert(text)
+        return text
+
+    def do_check_page(self, page):
+        # Parse a page again, returning the problems found
+        site = self.reload()
+        old = self.get_page(page)
+        if old.TYPE != "markdown":
+            return []
+        diagnostics = site.diagnostics
+        site.diagnostics = Diagnostics()
+        try:
+            page = site._instantiate(MarkdownPage, old.relpath)
+            page.scan()
+            BodyWriter().read(page)
+            found = site.diagnostics
+        finally:
+            site.diagnostics = diagnostics
+        return [found.format(entry) for entry in found.entries]
+
+    def do_list_tag(self, tag):
+        # List the pages with a tag, newest first
+        site = self.reload()
+        return [
+            {"relpath": p.relpath, "title": p.title, "date": p.date.isoformat()}
+            for p in site.tag_index.get(tag, ())]
+
+    def do_relocate_plan(self, page, dest):
+        # Show what relocating page to dest would change, without doing it
+        page = self.get_page(page)
+        if dest in self.site.pages:
+            raise RequestError("cannot relocate {} to existing page {}".format(page.relpath, dest))
+        return {
+            "move": [page.relpath, dest],
+            "aliases": page.aliases + [page.relpath],
+            "rewrite": sorted(self.index_backlinks().get(page.relpath, ())),
+        }
+
+    def handle(self, request):
+        # Run a request, given as a dict with a "command" and its arguments.
+        # Always return a response, so that a failed request does not close
+        # the connection
+        if not isinstance(request, dict):
+            return {"error": "invalid request: not a JSON object"}
+        args = dict(request)
+        command = args.pop("command", None)
+        func = getattr(self, "do_" + str(command).replace("-", "_"), None)
+        if func is None:
+            return {"error": "unknown command {}".format(command)}
+        try:
+            inspect.signature(func).bind(**args)
+        except TypeError as e:
+            return {"error": "invalid arguments for {}: {}".format(command, e)}
+        try:
+            with self.lock:
+                return {"result": func(**args)}
+        except RequestError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            log.exception("request %r failed", request)
+            return {"error": "{}: {}".format(e.__class__.__name__, e)}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    # Read one JSON request per line, and answer with one JSON line each
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {"error": "invalid request: {}".format(e)}
+            else:
+                response = self.server.daemon.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    # Serve each connection in its own thread, so that a connected client
+    # does not keep the others waiting
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        remove_stale_socket(path)
+        super().__init__(path, RequestHandler)
+
+
+def remove_stale_socket(path):
+    # Remove the socket left by a daemon that is not running anymore, and
+    # refuse to take the socket of one that is
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise ServeError("{} exists and is not a socket".format(path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            pass
+        else:
+            raise ServeError("another daemon is already listening on {}".format(path))
+    os.unlink(path)
+
+
+def serve(path, root, extrainfo=None):
+    daemon = SiteDaemon(root, extrainfo)
+    # Load the site before accepting requests
+    daemon.reload()
+    # Exit cleanly, removing the socket, when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with Server(path, daemon) as server:
+        log.info("Listening on %s", path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
@@ -0,0 +1,65 @@
+# coding: utf-8
+import datetime
+import functools
+
+# Timezone used for dates in the site that do not specify one
+TZ_SITE = "Europe/Rome"
+
+
+@functools.lru_cache(maxsize=None)
+def site_timezone():
+    import pytz
+    return pytz.timezone(TZ_SITE)
+
+
+# Build a UTC datetime from a unix timestamp
+def from_timestamp(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+
+
+# Parse the date of a [[!meta date]] directive into a timezone-aware datetime.
+# ISO-8601 dates are most of what we have, and datetime.fromisoformat is much
+# faster than dateutil, which is only used as a fallback for other formats.
+def parse(date):
+    try:
+        res = datetime.datetime.fromisoformat(date)
+    except ValueError:
+        from dateutil.parser import parse
+        res = parse(date)
+    if res.tzinfo is None:
+        res = site_timezone().localize(res)
+    return res
+
+
+# Convert date to the site timezone, returning the converted date and the UTC
+# offset formatted as "+HH:MM", or None for UTC. Dates are written in the site
+# timezone and not in the local one, so that the output does not depend on
+# the machine that generates it
+def _to_site(date):
+    ts = date.astimezone(site_timezone())
+    offset = ts.utcoffset()
+    if not offset:
+        return ts, None
+    offset_sec = int(offset.total_seconds())
+    offset_hrs, offset_min = divmod(abs(offset_sec), 3600)
+    return ts, '{0}{1:02d}:{2:02d}'.format("-" if offset_sec < 0 else "+", offset_hrs, offset_min // 60)
+
+
+# Format a date for ikiwiki's [[!meta date]]
+@functools.lru_cache(maxsize=4096)
+def format_ikiwiki(date):
+    ts, offset = _to_site(date)
+    return ts.strftime("%Y-%m-%d %H:%M:%S") + (offset or "Z")
+
+
+# Format a date for nikola's .. date: metadata
+@functools.lru_cache(maxsize=4096)
+def format_nikola(date):
+    ts, offset = _to_site(date)
+    return ts.strftime("%Y-%m-%d %H:%M:%S") + " UTC" + (offset or "")
+
+
+# Format a date for pelican's Date: metadata
+@functools.lru_cache(maxsize=4096)
+def format_pelican(date):
+    return date.astimezone(site_timezone()).strftime("%Y-%m-%d %H:%M")
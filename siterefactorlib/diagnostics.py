@@ -0,0 +1,85 @@
+# coding: utf-8
+import json
+import logging
+
+log = logging.getLogger()
+
+# Message of each diagnostic code, formatted with its arguments only when
+# reporting
+MESSAGES = {
+    "unresolved-link": "link {} cannot be resolved to a known resource",
+    "unresolved-image": "image {} cannot be resolved to a known resource",
+    "empty-link": "found link with no text and unresolved target",
+    "unsupported-directive": "found unsupported custom tag [[{}]]",
+    "misplaced-map": "found map tag not in first line",
+    "unsupported-tag-lookup": "found unsupported tag lookup: {}",
+    "missing-redirect": "redirects to missing page {}",
+    "relocate-conflict": "cannot relocate to existing page {}",
+    "unbuilt-link": "links to {}, which no shard generated",
+}
+
+
+class Diagnostics:
+    # Problems found in a site, recorded as (code, relpath, lineno, args)
+    # tuples. Recording is cheap and ignores duplicates, so that a problem
+    # found again by each writer pass is only reported once
+    def __init__(self):
+        # Entries in insertion order; values are unused
+        self.entries = {}
+
+    def add(self, code, relpath, lineno=None, *args):
+        self.entries[(code, relpath, lineno, args)] = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def to_list(self):
+        # Return the entries as a list that can be serialized as JSON, or sent
+        # to another process
+        return [[code, relpath, lineno, list(args)] for code, relpath, lineno, args in self.entries]
+
+    def merge(self, entries):
+        # Add entries from to_list() of another collector
+        for code, relpath, lineno, args in entries:
+            self.add(code, relpath, lineno, *args)
+
+    def format(self, entry):
+        code, relpath, lineno, args = entry
+        message = MESSAGES.get(code, code).format(*args)
+        if lineno is None:
+            return "{}: {}".format(relpath, message)
+        return "{}:{}: {}".format(relpath, lineno, message)
+
+    def grouped(self):
+        # Return a dict mapping each code to its entries, sorted by position
+        res = {}
+        for entry in self.entries:
+            res.setdefault(entry[0], []).append(entry)
+        for entries in res.values():
+            entries.sort(key=lambda e: (e[1], e[2] or 0))
+        return res
+
+    def log_summary(self, limit=None):
+        # Log all problems grouped by code, showing at most limit entries per
+        # group
+        for code, entries in sorted(self.grouped().items()):
+            log.warn("%s: %d found", code, len(entries))
+            shown = entries if limit is None else entries[:limit]
+            for entry in shown:
+                log.warn("  %s", self.format(entry))
+            if len(shown) < len(entries):
+                log.warn("  … and %d more", len(entries) - len(shown))
+
+    def write_json(self, pathname):
+        res = []
+        for code, entries in sorted(self.grouped().items()):
+            for entry in entries:
+                res.append({
+                    "code": code,
+                    "relpath": entry[1],
+                    "lineno": entry[2],
+                    "args": list(entry[3]),
+                    "message": self.format(entry),
+                })
+        with open(pathname, "wt") as out:
+            json.dump(res, out, indent=1)
@@ -1,74 +1,71 @@
 # coding: utf-8
 
-from .core import BodyWriter
-import os
-import shutil
+from .core import BodyWriter, type_dispatch
+from .manifest import write_manifest
+from .output import DirOutput
 import json
 import logging
 
 log = logging.getLogger()
 
 class BodyDumper(BodyWriter):
-    def print(self, *args):
-        parts = [str(self.lineno)]
+    def print(self, el, *args):
+        parts = [str(el.lineno)]
         parts.extend(str(x) for x in args)
-        self.output.append(" ".join(parts))
+        self.chunks.append(" ".join(parts) + "\n")
 
-    def line_code_begin(self, lang, **kw):
-        self.print("code_begin", lang)
+    def generate_line(self, el):
+        self.print(el, "line", el.line)
 
-    def line_code_end(self, **kw):
-        self.print("code_end")
+    def generate_codebegin(self, el):
+        self.print(el, "code_begin", el.lang)
 
-    def line_include_map(self, **kw):
-        self.print("map", self.line)
+    def generate_codeend(self, el):
+        self.print(el, "code_end")
 
-    def line_text(self, **kw):
-        self.print("line", self.line)
+    def generate_ikiwikimap(self, el):
+        self.print(el, "map", el.content)
 
-    def line_multi(self, parts, **kw):
-        self.print("multi", self.line)
-        for name, kw in parts:
-            getattr(self, name)(**kw)
+    def generate_text(self, el):
+        self.print(el, "  text", el.text)
 
-    def part_img(self, fname, alt, **kw):
-        self.print("  img", fname, alt)
+    def generate_eol(self, el):
+        self.print(el, "  eol")
 
-    def part_internal_link(self, text, target, **kw):
-        self.print("  internal_link", target, text)
+    def generate_inlineimage(self, el):
+        self.print(el, "  img", el.target.relpath if el.target is not None else None, el.text)
 
-    def part_text(self, text):
-        self.print("  text", text)
+    def generate_internallink(self, el):
+        self.print(el, "  internal_link", el.target.relpath if el.target is not None else None, el.text)
 
-    def part_directive(self, text):
-        self.print("  directive", text)
+    def generate_directive(self, el):
+        self.print(el, "  directive", el.content)
 
 
 class DumpWriter:
-    def __init__(self, root):
+    def __init__(self, root, threads=0):
         self.root = root
 
+        # Where the dump tree is written
+        self.output = DirOutput(root, threads)
+
     def write(self, site):
+        write = type_dispatch(self, "write_")
         for page in site.pages.values():
-            self.write_page(site.root, page)
+            write[page.TYPE](page)
 
-        for static in site.static.values():
-            self.write_static(site.root, static)
+        self.output.close()
+        write_manifest(self.output.root, self.output.written, self.output.hashes)
 
-    def write_static(self, src_root, static):
-        dst = os.path.join(self.root, static.relpath)
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        shutil.copy2(os.path.join(src_root, static.relpath), dst)
+    def write_static(self, page):
+        self.output.copy_file(page.relpath, page.abspath)
 
-    def write_page(self, src_root, page):
-        writer = BodyDumper(page)
-        page.parse_body(writer)
+    def write_markdown(self, page):
+        writer = BodyDumper()
+        writer.read(page)
         if writer.is_empty():
             return
 
-        dst = os.path.join(self.root, page.relpath + ".md")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-
         meta = {}
         if page.title is not None:
             meta["title"] = page.title
@@ -77,9 +74,7 @@ class DumpWriter:
         if page.date is not None:
             meta["date"] = page.date.strftime("%Y-%m-%d")
 
-        with open(dst, "wt") as out:
+        with self.output.open(page.relpath_without_extension + ".md") as out:
             json.dump(meta, out, indent=2)
             out.write("\n")
             writer.write(out)
-
-
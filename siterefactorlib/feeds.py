@@ -0,0 +1,62 @@
+# coding: utf-8
+# html.escape instead of xml.sax.saxutils, which imports urllib.request
+from html import escape
+from urllib.parse import quote
+
+
+def quoteattr(value):
+    return '"{}"'.format(escape(value))
+
+
+# Generate Atom feeds. Since ids must be absolute IRIs, feeds need the base
+# URL of the site
+class AtomFeeds:
+    def __init__(self, site_url, author):
+        # Base URL of the site, used to build absolute links and ids
+        self.site_url = site_url if site_url.endswith("/") else site_url + "/"
+
+        # Author of the feeds, inherited by all their entries
+        self.author = author
+
+        # relpath -> xml of entries already rendered for another feed of this
+        # build. Entries are not kept across builds: the HTML of every page is
+        # rendered at each build anyway, and it can change when the source of
+        # the page does not, like when a page it links to moves
+        self.entries = {}
+
+    def entry(self, page, url, html):
+        xml = self.entries.get(page.relpath)
+        if xml is not None:
+            return xml
+        url = self.site_url + quote(url)
+        xml = "\n".join((
+            "<entry xml:base={}>".format(quoteattr(url)),
+            "<title>{}</title>".format(escape(page.title or page.relpath_without_extension, quote=False)),
+            "<link href={}/>".format(quoteattr(url)),
+            "<id>{}</id>".format(escape(url, quote=False)),
+            "<updated>{}</updated>".format(page.date.isoformat()),
+            '<content type="html">{}</content>'.format(escape(html, quote=False)),
+            "</entry>",
+        ))
+        self.entries[page.relpath] = xml
+        return xml
+
+    def render(self, title, url, entries, updated):
+        # Render a feed from a sequence of (page, url, html), newest first.
+        # updated is the date of the feed when it has no entries
+        url = self.site_url + quote(url)
+        if entries:
+            updated = entries[0][0].date
+        res = [
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<feed xmlns="http://www.w3.org/2005/Atom">',
+            "<title>{}</title>".format(escape(title, quote=False)),
+            "<link rel=\"self\" href={}/>".format(quoteattr(url)),
+            "<id>{}</id>".format(escape(url, quote=False)),
+            "<author><name>{}</name></author>".format(escape(self.author, quote=False)),
+            "<updated>{}</updated>".format(updated.isoformat()),
+        ]
+        for page, page_url, html in entries:
+            res.append(self.entry(page, page_url, html))
+        res.append("</feed>")
+        return "\n".join(res) + "\n"
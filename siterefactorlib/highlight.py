@@ -0,0 +1,89 @@
+# coding: utf-8
+import hashlib
+import json
+import uuid
+
+
+class HighlightCache:
+    # Syntax highlighted HTML of code blocks, cached by language, code and
+    # highlighting options, so that only the blocks that changed are sent to
+    # Pygments
+    def __init__(self, markdown, cache):
+        from markdown.extensions.codehilite import CodeHiliteExtension
+        self.markdown = markdown
+
+        # Use the same options as the codehilite extension of markdown, so
+        # that the output is the same as for fenced code
+        self.config = {}
+        for ext in markdown.registeredExtensions:
+            if isinstance(ext, CodeHiliteExtension):
+                self.config = ext.getConfigs()
+        try:
+            import pygments
+            version = pygments.__version__
+        except ImportError:
+            version = None
+        self.options = json.dumps([sorted(self.config.items()), version], default=str)
+
+        # key -> html from the previous build
+        self.old_blocks = cache
+
+        # key -> html for this build
+        self.blocks = {}
+
+        self.count_hit = 0
+        self.count_miss = 0
+
+        # Code blocks are replaced in the markdown source with marker lines,
+        # that a preprocessor replaces with the highlighted HTML. The HTML
+        # cannot go in the markdown source directly, as markdown would process
+        # it, and the markers of the markdown HTML stash are removed from the
+        # source before preprocessing
+        self.marker = "siterefactor-code-" + uuid.uuid4().hex + "-"
+        # marker -> html for the code blocks of the page being rendered
+        self.pending = {}
+        markdown.preprocessors.register(stash_preprocessor(markdown, self), "siterefactor_code", 26)
+
+    def highlight(self, lang, code):
+        key = hashlib.sha256(json.dumps([lang, code, self.options]).encode()).hexdigest()
+        res = self.blocks.get(key)
+        if res is not None:
+            self.count_hit += 1
+            return res
+        res = self.old_blocks.get(key)
+        if res is not None:
+            self.count_hit += 1
+        else:
+            from markdown.extensions.codehilite import CodeHilite
+            config = dict(self.config)
+            style = config.pop("pygments_style", "default")
+            res = CodeHilite(code, lang=lang, style=style, **config).hilite(shebang=False)
+            self.count_miss += 1
+        self.blocks[key] = res
+        return res
+
+    def stash(self, lang, code):
+        # Return markdown text that renders as the highlighted code
+        marker = self.marker + str(len(self.pending))
+        self.pending[marker] = self.highlight(lang, code)
+        return "\n{}\n\n".format(marker)
+
+
+def stash_preprocessor(markdown, highlight):
+    from markdown.preprocessors import Preprocessor
+
+    class StashCode(Preprocessor):
+        # Replace the markers of HighlightCache with its HTML, stored in the
+        # markdown HTML stash
+        def run(self, lines):
+            res = []
+            for line in lines:
+                html = highlight.pending.get(line)
+                if html is None:
+                    res.append(line)
+                else:
+                    res.append(self.md.htmlStash.store(html))
+            highlight.pending.clear()
+            return res
+
+    return StashCode(markdown)
@@ -1,6 +1,9 @@
 # coding: utf-8
 
-from .core import BodyWriter, MarkdownPage
+from .core import BodyWriter, MarkdownPage, type_dispatch
+from . import content
+from .manifest import write_manifest
+from .output import DirOutput
 import json
 import os
 import re
@@ -9,7 +12,145 @@ import logging
 
 log = logging.getLogger()
 
+
+# Characters that Hugo removes from paths when making URLs: all but letters,
+# digits, marks, spaces, a few punctuation characters, and %-escapes
+re_url_unsafe = re.compile(r"%(?![0-9a-fA-F]{2})|[^\w\s.\-/\\#+~@%]")
+
+
+def urlize(path):
+    # Do what Hugo's urlize does to paths when making URLs
+    path = re_url_unsafe.sub("", path.strip())
+    return re.sub(r"\s+", "-", path).lower()
+
+
+class HugoPaths:
+    # Where pages go in the Hugo content tree, and the URLs Hugo gives them
+    def __init__(self, permalinks=False, bundles=False, rules=None):
+        # Link to final URLs instead of using relref shortcodes
+        self.permalinks = permalinks
+
+        # Write each page as a page bundle, with the images only it uses
+        self.bundles = bundles
+
+        # Hugo permalink rules: section -> pattern like "/:year/:month/:slug/"
+        self.rules = rules or {}
+
+        # relpath of static page -> page whose bundle contains it
+        self.bundled = {}
+
+        # relpaths of pages with pages below them, which become branch bundles
+        self.branches = set()
+
+    def assign_bundles(self, site):
+        # Move each image used by only one page in that page's bundle
+        users = {}
+        for page in site.pages.values():
+            if page.TYPE != "markdown": continue
+            parent = os.path.dirname(page.relpath)
+            while parent:
+                self.branches.add(parent)
+                parent = os.path.dirname(parent)
+            for el in page.body:
+                if isinstance(el, content.InlineImage) and el.target is not None and el.target.TYPE == "static":
+                    users.setdefault(el.target.relpath, set()).add(page)
+        taken = set()
+        for relpath, pages in sorted(users.items()):
+            if len(pages) != 1: continue
+            page = next(iter(pages))
+            dst = os.path.join(page.relpath_without_extension, os.path.basename(relpath))
+            if dst in taken: continue
+            taken.add(dst)
+            self.bundled[relpath] = page
+
+    def content_relpath(self, page):
+        # Pathname of the page in the content directory
+        if page.TYPE != "markdown":
+            owner = self.bundled.get(page.relpath)
+            if owner is None:
+                return page.relpath
+            return os.path.join(owner.relpath_without_extension, os.path.basename(page.relpath))
+        if not self.bundles:
+            return page.relpath_without_extension + ".md"
+        if page.relpath_without_extension in self.branches:
+            return os.path.join(page.relpath_without_extension, "_index.md")
+        return os.path.join(page.relpath_without_extension, "index.md")
+
+    def page_url(self, page):
+        # URL that Hugo generates for a markdown page
+        relpath = page.relpath_without_extension
+        section = relpath.split("/", 1)[0] if "/" in relpath else ""
+        rule = self.rules.get(section)
+        if rule is None or page.date is None or relpath in self.branches:
+            return "/" + urlize(relpath) + "/"
+        dirname, filename = os.path.split(relpath)
+        title = urlize(page.title or filename)
+        values = {
+            "year": page.date.strftime("%Y"),
+            "month": page.date.strftime("%m"),
+            "day": page.date.strftime("%d"),
+            "section": section,
+            "sections": dirname,
+            "title": title,
+            "slug": title,
+            "filename": filename,
+        }
+        url = re.sub(r":(\w+)", lambda mo: values.get(mo.group(1), mo.group(0)), rule)
+        return urlize(url)
+
+    def static_url(self, page):
+        # URL of a static file
+        owner = self.bundled.get(page.relpath)
+        if owner is None:
+            return "/" + page.relpath
+        return self.page_url(owner) + os.path.basename(page.relpath)
+
+
+def load_permalink_rules(root):
+    # Read the permalink rules from the Hugo configuration in root
+    for name in ("hugo.toml", "config.toml"):
+        pathname = os.path.join(root, name)
+        if not os.path.exists(pathname): continue
+        try:
+            import tomllib
+        except ImportError:
+            log.warn("%s: cannot read permalink rules without tomllib", pathname)
+            return {}
+        with open(pathname, "rb") as fd:
+            return page_permalink_rules(pathname, tomllib.load(fd).get("permalinks", {}))
+    for name in ("hugo.json", "config.json"):
+        pathname = os.path.join(root, name)
+        if not os.path.exists(pathname): continue
+        with open(pathname, "rt") as fd:
+            return page_permalink_rules(pathname, json.load(fd).get("permalinks", {}))
+    return {}
+
+
+def page_permalink_rules(pathname, permalinks):
+    # Return the rules that apply to pages from a permalinks configuration.
+    # Besides the section = pattern form, newer Hugo versions have one table
+    # per kind, like [permalinks.page] and [permalinks.section]: only the page
+    # table applies to pages, and it takes precedence
+    res = {}
+    for section, rule in permalinks.items():
+        if isinstance(rule, str):
+            res.setdefault(section, rule)
+        elif section == "page" and isinstance(rule, dict):
+            for section, rule in rule.items():
+                if isinstance(rule, str):
+                    res[section] = rule
+                else:
+                    log.warn("%s: ignoring permalinks.page.%s, which is not a string", pathname, section)
+        elif not isinstance(rule, dict):
+            log.warn("%s: ignoring permalinks.%s, which is not a string", pathname, section)
+    return res
+
+
 class HugoMarkdown(BodyWriter):
+    def __init__(self, paths=None):
+        super().__init__()
+        self.paths = paths if paths is not None else HugoPaths()
+
     def generate_codebegin(self, el):
         self.chunks.append("{{{{< highlight {} >}}}}".format(el.lang))
 
@@ -23,18 +164,35 @@ class HugoMarkdown(BodyWriter):
         if el.target is None:
             self.chunks.append("(missing image: {alt})".format(alt=el.text))
         else:
-            #path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
-            path = el.target.relpath
-            self.chunks.append('{{{{< figure src="/{fname}" alt="{alt}" >}}}}'.format(fname=path, alt=el.text))
+            if self.paths.bundled.get(el.target.relpath) is el.page:
+                # Page resource
+                path = os.path.basename(el.target.relpath)
+            else:
+                path = self.paths.static_url(el.target)
+            if self.paths.permalinks:
+                self.chunks.append('![{alt}]({fname})'.format(fname=path, alt=el.text))
+            else:
+                self.chunks.append('{{{{< figure src="{fname}" alt="{alt}" >}}}}'.format(fname=path, alt=el.text))
 
     def generate_internallink(self, el):
         if el.target is None:
-            self.chunks.append(el.text)
-        elif el.target.TYPE == "markdown":
-            #path = os.path.relpath(el.target.relpath_without_extension, os.path.dirname(el.page.relpath))
-            self.chunks.append('[{text}]({{{{< relref "{target}.md" >}}}})'.format(text=el.text, target=el.target.relpath_without_extension))
+            if el.text is None:
+                el.page.site.diagnostics.add("empty-link", el.page.relpath, el.lineno)
+            else:
+                self.chunks.append(el.text)
+            return
+
+        text = el.text
+        if text is None:
+            text = el.target.title or el.target.relpath_without_extension
+        if el.target.TYPE == "markdown":
+            if self.paths.permalinks:
+                self.chunks.append('[{text}]({target})'.format(text=text, target=self.paths.page_url(el.target)))
+            else:
+                target = os.path.splitext(self.paths.content_relpath(el.target))[0]
+                self.chunks.append('[{text}]({{{{< relref "{target}.md" >}}}})'.format(text=text, target=target))
         else:
-            self.chunks.append('[{text}](/{target})'.format(text=el.text, target=el.target.relpath))
+            self.chunks.append('[{text}]({target})'.format(text=text, target=self.paths.static_url(el.target)))
 
     def generate_directive(self, el):
         super().generate_directive(el)
@@ -42,34 +200,42 @@ class HugoMarkdown(BodyWriter):
 
 
 class HugoWriter:
-    def __init__(self, root):
+    def __init__(self, root, permalinks=False, bundles=False, output=None, threads=0):
         # Root directory of the destination
         self.root = root
 
+        # Where the content tree is written
+        self.output = output if output is not None else DirOutput(os.path.join(root, "content"), threads)
+
+        self.paths = HugoPaths(permalinks, bundles, load_permalink_rules(root) if permalinks else None)
+
     def write(self, site):
         # Relocate yyyy/* under blog/
         for relpath, page in list(site.pages.items()):
             if re.match(r"^\d{4}/", relpath):
                 site.relocate(page, os.path.join("blog", relpath))
 
+        if self.paths.bundles:
+            self.paths.assign_bundles(site)
+
         # Generate output
+        write = type_dispatch(self, "write_")
         for page in site.pages.values():
-            getattr(self, "write_" + page.TYPE)(page)
+            write[page.TYPE](page)
+
+        self.output.close()
+        if isinstance(self.output, DirOutput):
+            write_manifest(self.output.root, self.output.written, self.output.hashes)
 
     def write_static(self, page):
-        dst = os.path.join(self.root, "content", page.relpath)
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        shutil.copy2(os.path.join(page.site.root, page.orig_relpath), dst)
+        self.output.copy_file(self.paths.content_relpath(page), page.abspath)
 
     def write_markdown(self, page):
-        writer = HugoMarkdown()
+        writer = HugoMarkdown(self.paths)
         writer.read(page)
         if writer.is_empty():
             return
 
-        dst = os.path.join(self.root, "content", page.relpath_without_extension + ".md")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-
         meta = {}
         if page.title is not None:
             meta["title"] = page.title
@@ -78,7 +244,7 @@ class HugoWriter:
         if page.date is not None:
             meta["date"] = page.date.strftime("%Y-%m-%d")
 
-        with open(dst, "wt") as out:
+        with self.output.open(self.paths.content_relpath(page)) as out:
             json.dump(meta, out, indent=2)
             out.write("\n")
             writer.write(out)
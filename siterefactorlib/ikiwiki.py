@@ -1,7 +1,12 @@
 # coding: utf-8
 
-from .core import BodyWriter, MarkdownPage
+from .core import BodyWriter, MarkdownPage, type_dispatch
+from .diagnostics import Diagnostics
+from .manifest import write_manifest
+from .output import DirOutput
+import io
 import json
+import multiprocessing
 import os
 import re
 import shutil
@@ -23,17 +28,17 @@ class IkiwikiMarkdown(BodyWriter):
         if el.target is None:
             self.chunks.append("(missing image: {alt})".format(alt=el.text))
         else:
-            path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath)
             self.chunks.append('[[!img {fname} alt="{alt}"]]'.format(fname=path, alt=el.text))
 
     def generate_internallink(self, el):
         if el.target is None:
             if el.text is None:
-                log.warn("%s:%s: found link with no text and unresolved target", el.page.relpath, el.lineno)
+                el.page.site.diagnostics.add("empty-link", el.page.relpath, el.lineno)
             else:
                 self.chunks.append(el.text)
         elif el.target.TYPE == "markdown":
-            path = os.path.relpath(el.target.relpath_without_extension, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath_without_extension)
             if path.startswith("../"):
                 path = el.target.relpath_without_extension
             if el.text is None or el.text == path:
@@ -41,7 +46,7 @@ class IkiwikiMarkdown(BodyWriter):
             else:
                 self.chunks.append('[[{text}|{target}]]'.format(text=el.text, target=path))
         else:
-            path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath)
             if path.startswith("../"):
                 path = el.target.relpath
             if el.text is None:
@@ -54,34 +59,62 @@ class IkiwikiMarkdown(BodyWriter):
         self.chunks.append("[[{}]]".format(el.content))
 
 
+def render_markdown(page, source_date_only=False):
+    # Render a markdown page as ikiwiki source, or return None if it has no
+    # content. If source_date_only is True, only write the date if it was in
+    # the page source
+    writer = IkiwikiMarkdown()
+    writer.read(page)
+    if writer.is_empty():
+        return None
+
+    out = io.StringIO()
+    if page.date is not None and (page.date_in_source or not source_date_only):
+        print('[[!meta date="{date}"]]'.format(date=page.date_as_iso8601), file=out)
+    if page.tags:
+        print("[[!tag {tags}]]".format(
+            tags=" ".join("tags/{tag}".format(tag=tag) for tag in sorted(page.tags))), file=out)
+    if page.title is not None:
+        print("# {title}".format(title=page.title), file=out)
+    out.write("\n")
+    writer.write(out)
+    return out.getvalue()
+
+
+def strip_leading_blanks(site):
+    # Remove leading spaces from markdown content
+    for page in site.pages.values():
+        if page.TYPE != "markdown": continue
+        while page.body and page.body[0].is_blank:
+            page.body.pop(0)
+
+
 class IkiwikiWriter:
-    def __init__(self, root):
+    def __init__(self, root, output=None, threads=0):
         # Root directory of the destination
         self.root = root
 
+        # Where the wiki tree is written
+        self.output = output if output is not None else DirOutput(root, threads)
+
     def write(self, site):
         # Relocate yyyy/* under blog/
         for relpath, page in list(site.pages.items()):
             if re.match(r"^\d{4}/", relpath):
                 site.relocate(page, os.path.join("blog", relpath))
 
-        # Remove leading spaces from markdown content
-        for page in site.pages.values():
-            if page.TYPE != "markdown": continue
-            while page.body and page.body[0].is_blank:
-                page.body.pop(0)
+        strip_leading_blanks(site)
 
         # Generate output
+        write = type_dispatch(self, "write_")
         for page in site.pages.values():
-            getattr(self, "write_" + page.TYPE)(page)
+            write[page.TYPE](page)
 
         # Generate tag indices
         tags = set()
         tags.update(*(x.tags for x in site.pages.values()))
-        for tag in tags:
-            dst = os.path.join(self.root, "tags", tag + ".mdwn")
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            with open(dst, "wt") as out:
+        for tag in sorted(tags):
+            with self.output.open(os.path.join("tags", tag + ".mdwn")) as out:
                 desc = site.tag_descriptions.get(tag, None)
                 if desc is None:
                     desc = [tag.capitalize() + "."]
@@ -91,39 +124,106 @@ class IkiwikiWriter:
                 print('[[!inline pages="link(tags/{tag})" show="10"]]'.format(tag=tag), file=out)
 
         # Generate index of tags
-        dst = os.path.join(self.root, "tags/index.mdwn")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        with open(dst, "wt") as out:
+        with self.output.open("tags/index.mdwn") as out:
             print('[[!pagestats pages="tags/*"]]', file=out)
             print('[[!inline pages="tags/*"]]', file=out)
 
+        self.output.close()
+        if isinstance(self.output, DirOutput):
+            write_manifest(self.output.root, self.output.written, self.output.hashes)
+
     def write_static(self, page):
-        dst = os.path.join(self.root, page.relpath)
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        shutil.copy2(os.path.join(page.site.root, page.orig_relpath), dst)
+        self.output.copy_file(page.relpath, page.abspath)
 
     def write_markdown(self, page):
-        writer = IkiwikiMarkdown()
-        writer.read(page)
-        if writer.is_empty():
+        text = render_markdown(page)
+        if text is None:
             return
 
-        dst = os.path.join(self.root, page.relpath_without_extension + ".mdwn")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-
-        with open(dst, "wt") as out:
-            if page.date is not None:
-                print('[[!meta date="{date}"]]'.format(date=page.date_as_iso8601), file=out)
-            if page.tags:
-                print("[[!tag {tags}]]".format(
-                    tags=" ".join("tags/{tag}".format(tag=tag) for tag in sorted(page.tags))), file=out)
-            if page.title is not None:
-                print("# {title}".format(title=page.title), file=out)
-            out.write("\n")
-            writer.write(out)
+        self.output.write_text(page.relpath_without_extension + ".mdwn", text)
 
         for relpath in page.aliases:
-            dst = os.path.join(self.root, relpath)
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            with open(dst, "wt") as out:
+            with self.output.open(relpath) as out:
                 print('[[!meta redir="{relpath}"]]'.format(relpath=page.relpath_without_extension), file=out)
+
+
+# Site being formatted, inherited by the worker processes of IkiwikiFormatter
+_fmt_site = None
+
+
+def _fmt_page(relpath):
+    # Normalize a page, returning its relpath, the normalized source if it
+    # differs from the current one, and the problems found
+    site = _fmt_site
+    site.diagnostics = Diagnostics()
+    page = site.pages[relpath]
+    # A date taken from the file mtime would change at each checkout
+    text = render_markdown(page, source_date_only=True)
+    if text is not None:
+        # Compare newlines too, to normalize CRLF sources
+        with open(os.path.join(site.root, page.orig_relpath), "rt", encoding="utf-8", newline="") as fd:
+            if fd.read() == text:
+                text = None
+    return relpath, text, site.diagnostics.to_list()
+
+
+class IkiwikiFormatter:
+    # Normalize the markdown pages of an ikiwiki source tree in place, without
+    # relocating them. Only the files whose normalized source differs are
+    # rewritten, or just listed if check is True.
+    #
+    # Pages are rendered by a pool of forked processes, that get the site
+    # from the parent instead of having it pickled
+    def __init__(self, check=False, jobs=None):
+        self.check = check
+
+        # Number of worker processes
+        self.jobs = jobs or os.cpu_count() or 1
+
+        # Relpaths of the pages whose source is not normalized
+        self.changed = []
+
+    def write(self, site):
+        global _fmt_site
+        strip_leading_blanks(site)
+
+        relpaths = sorted(relpath for relpath, page in site.pages.items() if page.TYPE == "markdown")
+        diagnostics = site.diagnostics
+        _fmt_site = site
+        try:
+            if self.jobs > 1 and "fork" in multiprocessing.get_all_start_methods():
+                with multiprocessing.get_context("fork").Pool(self.jobs) as pool:
+                    for res in pool.imap(_fmt_page, relpaths, chunksize=16):
+                        self.process(site, diagnostics, *res)
+            else:
+                for relpath in relpaths:
+                    self.process(site, diagnostics, *_fmt_page(relpath))
+        finally:
+            _fmt_site = None
+            site.diagnostics = diagnostics
+
+        if self.check:
+            log.warn("%d of %d pages need formatting", len(self.changed), len(relpaths))
+        else:
+            log.warn("Reformatted %d of %d pages", len(self.changed), len(relpaths))
+
+    def process(self, site, diagnostics, relpath, text, entries):
+        diagnostics.merge(entries)
+        if text is None:
+            return
+        self.changed.append(relpath)
+        if self.check:
+            print(relpath)
+            return
+        pathname = os.path.join(site.root, site.pages[relpath].orig_relpath)
+        log.info("Reformatting %s", relpath)
+        tmp = pathname + ".tmp"
+        try:
+            with open(tmp, "wt", encoding="utf-8", newline="") as out:
+                out.write(text)
+            shutil.copymode(pathname, tmp)
+            os.replace(tmp, pathname)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
@@ -0,0 +1,189 @@
+# coding: utf-8
+from concurrent.futures import ProcessPoolExecutor
+from .manifest import file_hash
+import hashlib
+import json
+import os
+import logging
+
+log = logging.getLogger()
+
+# Extensions of images that can be resized
+RESIZABLE = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+# Version of the resizing code, part of the cache key of resized images
+RESIZE_VERSION = 2
+
+# EXIF tag with the orientation of the image
+EXIF_ORIENTATION = 0x0112
+
+
+def resize(src, dest, fmt, widths, webp):
+    # Write resized versions of src as dest-<width>.<ext> for each width
+    # smaller than the image, and dest-<width>.webp if webp is True. Write
+    # dest.json with the image size and the list of generated widths.
+    #
+    # The EXIF orientation is applied to the pixels, and the rest of the EXIF
+    # data is kept in the resized versions.
+    #
+    # This runs in worker processes.
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as orig:
+        img = ImageOps.exif_transpose(orig)
+        exif = img.getexif()
+        exif.pop(EXIF_ORIENTATION, None)
+        extra = {"exif": exif.tobytes()} if exif else {}
+        width, height = img.size
+        ext = os.path.splitext(src)[1].lower()
+        generated = []
+        for w in widths:
+            if w >= width:
+                continue
+            resized = img.resize((w, round(height * w / width)), Image.LANCZOS)
+            if fmt == "JPEG":
+                resized.save("{}-{}{}".format(dest, w, ext), fmt, quality=85, optimize=True, progressive=True, **extra)
+            else:
+                resized.save("{}-{}{}".format(dest, w, ext), fmt, optimize=True, **extra)
+            if webp:
+                resized.save("{}-{}.webp".format(dest, w), "WEBP", quality=80, **extra)
+            generated.append(w)
+        if webp:
+            img.save(dest + ".webp", "WEBP", quality=80, **extra)
+
+    info = {"width": width, "height": height, "widths": generated, "webp": webp}
+    with open(dest + ".json.tmp", "wt") as out:
+        json.dump(info, out)
+    os.replace(dest + ".json.tmp", dest + ".json")
+    return info
+
+
+def image_info(src, widths, webp):
+    # Return the information that resize() would return for src, reading
+    # only the image header
+    from PIL import Image
+
+    with Image.open(src) as img:
+        width, height = img.size
+        # Orientations that swap width and height
+        if img.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+    return {"width": width, "height": height, "widths": [w for w in widths if w < width], "webp": webp}
+
+
+class ImageDerivatives:
+    # Resized versions of images, cached by hash of the source image and
+    # resize parameters
+    def __init__(self, cachedir, widths=(480, 960, 1920), webp=False):
+        self.cachedir = os.path.join(cachedir, "images")
+        self.widths = tuple(widths)
+        self.webp = webp
+
+        # relpath -> (cache basename, info) for each resized image
+        self.variants = {}
+
+    def _source_hashes(self, images):
+        # Hash the source images, reusing hashes of files whose size and mtime
+        # did not change
+        cache_file = os.path.join(self.cachedir, "sources.json")
+        try:
+            with open(cache_file, "rt") as fd:
+                old = json.load(fd)
+        except FileNotFoundError:
+            old = {}
+        new = {}
+        for relpath, abspath in images.items():
+            st = os.stat(abspath)
+            cached = old.get(abspath)
+            if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                new[abspath] = cached
+            else:
+                new[abspath] = [st.st_size, st.st_mtime_ns, file_hash(abspath)]
+        with open(cache_file, "wt") as out:
+            json.dump(new, out)
+        return new
+
+    def build(self, images, workers=None, only=None):
+        # Generate the resized versions of images, a dict mapping the relpath
+        # of each image to its absolute source pathname. If only is a set of
+        # relpaths, only resize those images, and only read the size of the
+        # others, which is enough to build their srcset attributes
+        try:
+            import PIL
+        except ImportError:
+            log.warn("PIL is not available: images will not be resized")
+            return
+
+        os.makedirs(self.cachedir, exist_ok=True)
+        hashes = self._source_hashes(images)
+
+        params = "{}:{}:{}".format(",".join(str(w) for w in self.widths), self.webp, RESIZE_VERSION)
+        todo = []
+        keys = set()
+        count_measured = 0
+        for relpath, abspath in images.items():
+            key = hashlib.sha256("{}:{}".format(hashes[abspath][2], params).encode()).hexdigest()
+            keys.add(key)
+            dest = os.path.join(self.cachedir, key)
+            try:
+                with open(dest + ".json", "rt") as fd:
+                    self.variants[relpath] = (dest, json.load(fd))
+            except FileNotFoundError:
+                if only is not None and relpath not in only:
+                    try:
+                        self.variants[relpath] = (dest, image_info(abspath, self.widths, self.webp))
+                    except Exception as e:
+                        log.warn("%s: cannot read image size: %s", relpath, e)
+                    count_measured += 1
+                    continue
+                fmt = RESIZABLE[os.path.splitext(abspath)[1].lower()]
+                todo.append((relpath, abspath, dest, fmt))
+
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    (relpath, dest, executor.submit(resize, abspath, dest, fmt, self.widths, self.webp))
+                    for relpath, abspath, dest, fmt in todo]
+                for relpath, dest, future in futures:
+                    try:
+                        self.variants[relpath] = (dest, future.result())
+                    except Exception as e:
+                        log.warn("%s: cannot resize image: %s", relpath, e)
+
+        log.info("Images: %d resized, %d from cache, %d only measured",
+                 len(todo), len(images) - len(todo) - count_measured, count_measured)
+
+        self.prune(keys)
+
+    def prune(self, keys):
+        # Remove the cached versions of images that are not used anymore. Cache
+        # files are named after the 64 hex digits of their key
+        for f in os.listdir(self.cachedir):
+            if f == "sources.json":
+                continue
+            if f[:64] not in keys:
+                os.unlink(os.path.join(self.cachedir, f))
+
+    def outputs(self, relpath):
+        # Return a list of (relpath, cache pathname) of the derivatives of
+        # relpath to copy to the output
+        dest, info = self.variants[relpath]
+        base, ext = os.path.splitext(relpath)
+        res = []
+        for w in info["widths"]:
+            res.append(("{}-{}w{}".format(base, w, ext), "{}-{}{}".format(dest, w, ext.lower())))
+            if info["webp"]:
+                res.append(("{}-{}w.webp".format(base, w), "{}-{}.webp".format(dest, w)))
+        if info["webp"]:
+            res.append((base + ".webp", dest + ".webp"))
+        return res
+
+    def srcset(self, relpath, url, ext=None):
+        # Return the srcset attribute for the image at relpath, linked as url.
+        # If ext is given, build it for the versions with that extension
+        dest, info = self.variants[relpath]
+        base, orig_ext = os.path.splitext(url)
+        ext = ext or orig_ext
+        res = ["{}-{}w{} {}w".format(base, w, ext, w) for w in info["widths"]]
+        res.append("{} {}w".format(base + ext, info["width"]))
+        return ", ".join(res)
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+from .core import BodyWriter, type_dispatch
+import json
+import sys
+import logging
+
+log = logging.getLogger()
+
+
+class BodyExporter(BodyWriter):
+    # Collect links, images and directives of a page body, and measure its
+    # text
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.images = []
+        self.directives = []
+        self.text_length = 0
+
+    def generate_line(self, el):
+        self.text_length += len(el.line)
+
+    def generate_text(self, el):
+        self.text_length += len(el.text)
+
+    def generate_eol(self, el):
+        pass
+
+    def generate_inlineimage(self, el):
+        if el.target is not None:
+            self.images.append(el.target.relpath)
+
+    def generate_internallink(self, el):
+        if el.target is not None:
+            self.links.append(el.target.relpath)
+        if el.text is not None:
+            self.text_length += len(el.text)
+
+    def generate_directive(self, el):
+        super().generate_directive(el)
+        self.directives.append(el.content)
+
+
+class JsonlWriter:
+    # Export one JSON record per page to a JSON Lines file, writing each
+    # record as soon as it is built
+    def __init__(self, pathname):
+        # Destination file, or "-" for standard output
+        self.pathname = pathname
+
+    def write(self, site):
+        if self.pathname == "-":
+            self.export(site, sys.stdout)
+        else:
+            with open(self.pathname, "wt") as out:
+                self.export(site, out)
+
+    def export(self, site, out):
+        record = type_dispatch(self, "record_")
+        for relpath in sorted(site.pages):
+            page = site.pages[relpath]
+            out.write(json.dumps(record[page.TYPE](page), ensure_ascii=False))
+            out.write("\n")
+
+    def record(self, page):
+        return {
+            "relpath": page.relpath,
+            "orig_relpath": page.orig_relpath,
+            "type": page.TYPE,
+            "aliases": page.aliases,
+            "title": page.title,
+            "tags": sorted(page.tags),
+            "date": page.date.isoformat() if page.date is not None else None,
+        }
+
+    def record_static(self, page):
+        return self.record(page)
+
+    def record_markdown(self, page):
+        exporter = BodyExporter()
+        exporter.read(page)
+        res = self.record(page)
+        res["links"] = exporter.links
+        res["images"] = exporter.images
+        res["directives"] = exporter.directives
+        res["text_length"] = exporter.text_length
+        return res
@@ -0,0 +1,203 @@
+# coding: utf-8
+import hashlib
+import json
+import os
+import shutil
+import logging
+
+log = logging.getLogger()
+
+
+# Name of the manifest of an output directory, kept inside it. It is not
+# listed in the manifest itself
+MANIFEST_NAME = ".siterefactor-manifest.json"
+
+
+def manifest_path(outdir):
+    # Pathname of the manifest of an output directory
+    return os.path.join(outdir, MANIFEST_NAME)
+
+
+def file_hash(abspath):
+    h = hashlib.sha256()
+    with open(abspath, "rb") as fd:
+        while True:
+            buf = fd.read(1024 * 1024)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+class Manifest:
+    # List of all the files in an output tree, with their size and content
+    # hash
+    def __init__(self):
+        # relpath -> {"size": int, "mtime_ns": int, "sha256": str}
+        self.files = {}
+
+    @classmethod
+    def load(cls, pathname):
+        res = cls()
+        with open(pathname, "rt") as fd:
+            res.files = json.load(fd)["files"]
+        return res
+
+    def save(self, pathname):
+        tmp = pathname + ".tmp"
+        with open(tmp, "wt") as out:
+            json.dump({"files": self.files}, out, indent=1, sort_keys=True)
+        os.replace(tmp, pathname)
+
+    @staticmethod
+    def walk(root):
+        # Generate the relpaths of all the files in root, except the manifest
+        for dirpath, dirnames, filenames in os.walk(root):
+            for f in filenames:
+                relpath = os.path.relpath(os.path.join(dirpath, f), root)
+                if relpath != MANIFEST_NAME:
+                    yield relpath
+
+    @classmethod
+    def scan(cls, root, previous=None, relpaths=None):
+        # Build the manifest of the files relpaths in root, or of all the files
+        # in root if relpaths is None. Hashes are taken from previous for files
+        # whose size and mtime did not change
+        if relpaths is None:
+            relpaths = cls.walk(root)
+        res = cls()
+        for relpath in sorted(relpaths):
+            abspath = os.path.join(root, relpath)
+            st = os.stat(abspath)
+            old = previous.files.get(relpath) if previous is not None else None
+            if old is not None and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                digest = old["sha256"]
+            else:
+                digest = file_hash(abspath)
+            res.files[relpath] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        return res
+
+    @property
+    def digest(self):
+        # Hash identifying the contents of the whole tree
+        h = hashlib.sha256()
+        for relpath, info in sorted(self.files.items()):
+            h.update("{}\0{}\0".format(relpath, info["sha256"]).encode())
+        return h.hexdigest()
+
+    def diff(self, old):
+        # Compute the (added, changed, removed) relpaths going from old to
+        # self
+        added = []
+        changed = []
+        for relpath, info in self.files.items():
+            old_info = old.files.get(relpath)
+            if old_info is None:
+                added.append(relpath)
+            elif old_info["sha256"] != info["sha256"]:
+                changed.append(relpath)
+        removed = [relpath for relpath in old.files if relpath not in self.files]
+        return sorted(added), sorted(changed), sorted(removed)
+
+
+def scan_manifest(outdir, relpaths=None, known=None):
+    # Build the manifest of an output directory, reusing the hashes of its
+    # previous manifest for unchanged files. If relpaths is given, only list
+    # those files, for directories that also contain files not generated by
+    # siterefactor. known maps relpaths to manifest entries already computed
+    # while writing, that take precedence over the previous manifest
+    try:
+        previous = Manifest.load(manifest_path(outdir))
+    except FileNotFoundError:
+        previous = None
+    if known:
+        if previous is None:
+            previous = Manifest()
+        previous.files.update(known)
+    return Manifest.scan(outdir, previous, relpaths)
+
+
+def write_manifest(outdir, relpaths=None, known=None):
+    # Build and save the manifest of an output directory
+    manifest = scan_manifest(outdir, relpaths, known)
+    manifest.save(manifest_path(outdir))
+    return manifest
+
+
+class Deployer:
+    # Deploy an output tree to a target directory, as a new release that
+    # shares unchanged files with the current one, made live with an atomic
+    # switch of the "current" symlink.
+    #
+    # The target directory contains:
+    #   releases/<hash>/               one tree per release
+    #   releases/<hash>.manifest.json  manifest of each release
+    #   current                        symlink to the live release
+    def __init__(self, target, keep=3):
+        self.target = target
+        self.releases = os.path.join(target, "releases")
+        self.current = os.path.join(target, "current")
+        # Number of releases to keep
+        self.keep = keep
+
+    def current_release(self):
+        try:
+            name = os.path.basename(os.readlink(self.current))
+        except FileNotFoundError:
+            return None, Manifest()
+        return name, Manifest.load(os.path.join(self.releases, name + ".manifest.json"))
+
+    def deploy(self, srcdir, manifest, dry_run=False):
+        old_name, old = self.current_release()
+        added, changed, removed = manifest.diff(old)
+        log.info("Deploying %s: %d added, %d changed, %d removed",
+                 srcdir, len(added), len(changed), len(removed))
+
+        name = manifest.digest[:16]
+        if dry_run or name == old_name:
+            return added, changed, removed
+
+        dest = os.path.join(self.releases, name)
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        new_files = set(added)
+        new_files.update(changed)
+        for relpath in sorted(manifest.files):
+            dst = os.path.join(dest, relpath)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if relpath in new_files:
+                # Copy new content: hardlinking the source would let the next
+                # build modify the deployed file in place
+                shutil.copy2(os.path.join(srcdir, relpath), dst)
+            else:
+                src = os.path.join(self.releases, old_name, relpath)
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+        manifest.save(dest + ".manifest.json")
+
+        # Atomically switch the live tree
+        tmp = self.current + ".tmp"
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(os.path.join("releases", name), tmp)
+        os.replace(tmp, self.current)
+
+        self.prune(name)
+        return added, changed, removed
+
+    def prune(self, live):
+        # Remove the oldest releases, keeping the last self.keep
+        manifests = []
+        for f in os.listdir(self.releases):
+            if f.endswith(".manifest.json"):
+                pathname = os.path.join(self.releases, f)
+                manifests.append((os.path.getmtime(pathname), f[:-len(".manifest.json")]))
+        manifests.sort(reverse=True)
+        for mtime, name in manifests[self.keep:]:
+            if name == live:
+                continue
+            log.info("Removing old release %s", name)
+            shutil.rmtree(os.path.join(self.releases, name), ignore_errors=True)
+            os.unlink(os.path.join(self.releases, name + ".manifest.json"))
@@ -1,95 +1,96 @@
 # coding: utf-8
 
-from .core import BodyWriter
+from .core import BodyWriter, type_dispatch
+from .manifest import write_manifest
+from .output import DirOutput
+from . import dates
 import os
-import shutil
-import pytz
-from dateutil.tz import tzlocal
 import logging
 
 log = logging.getLogger()
 
 class BodyNikola(BodyWriter):
-    def line_code_begin(self, lang, **kw):
-        self.output.append("```{}".format(lang))
+    def generate_codebegin(self, el):
+        self.chunks.append("```{lang}\n".format(lang=el.lang))
 
-    def line_code_end(self, **kw):
-        self.output.append("```")
+    def generate_codeend(self, el):
+        self.chunks.append("```\n")
 
-    def line_text(self, **kw):
-        self.output.append(self.line)
-
-    def line_multi(self, parts, **kw):
-        res = []
-        for name, kw in parts:
-            res.append(getattr(self, name)(**kw))
-        self.output.append("".join(res))
-
-    def part_img(self, fname, alt, **kw):
+    def generate_inlineimage(self, el):
+        if el.target is None:
+            self.chunks.append("(missing image: {alt})".format(alt=el.text))
+            return
+        fname = el.page.site.link_path(el.page.relpath, el.target.relpath)
         # Hack to work around nikola being unable to resolve the actual
         # location of resources when PRETTY_URLS is used.
         # See https://github.com/getnikola/nikola/issues/2266
         dirname, filename = os.path.split(fname)
         fname = os.path.normpath(os.path.join(dirname, "..", filename))
-        return '![{alt}]({fname})'.format(fname=fname, alt=alt)
-
-    def part_internal_link(self, text, target, **kw):
-        dest = self.page.resolve_link_relpath(target)
-        return '[{text}]({target}.md)'.format(text=text, target=dest)
+        self.chunks.append('![{alt}]({fname})'.format(fname=fname, alt=el.text))
+
+    def generate_internallink(self, el):
+        if el.target is None:
+            if el.text is None:
+                el.page.site.diagnostics.add("empty-link", el.page.relpath, el.lineno)
+            else:
+                self.chunks.append(el.text)
+            return
 
-    def part_text(self, text):
-        return text
+        text = el.text
+        if text is None:
+            text = el.target.title or el.target.relpath_without_extension
+        if el.target.TYPE == "markdown":
+            target = el.page.site.link_path(el.page.relpath, el.target.relpath_without_extension) + ".md"
+        else:
+            target = el.page.site.link_path(el.page.relpath, el.target.relpath)
+        self.chunks.append('[{text}]({target})'.format(text=text, target=target))
 
-    def part_directive(self, text):
-        log.warn("%s:%s: found unsupported custom tag [[%s]]", self.page.relpath, self.lineno, text)
-        return "[[{}]]".format(text)
+    def generate_directive(self, el):
+        super().generate_directive(el)
+        self.chunks.append("[[{}]]".format(el.content))
 
 
 class NikolaWriter:
-    def __init__(self, root):
+    def __init__(self, root, threads=0):
         # Root directory of the destination
         self.root = root
 
+        # Where the site tree is written
+        self.output = DirOutput(root, threads)
+
     def write(self, site):
+        # Remove leading spaces from markdown content
+        for page in site.pages.values():
+            if page.TYPE != "markdown": continue
+            while page.body and page.body[0].is_blank:
+                page.body.pop(0)
+
+        # Generate output
+        write = type_dispatch(self, "write_")
         for page in site.pages.values():
-            self.write_page(site.root, page)
+            write[page.TYPE](page)
 
-        for static in site.static.values():
-            self.write_static(site.root, static)
+        self.output.close()
+        write_manifest(self.output.root, self.output.written, self.output.hashes)
 
-    def write_static(self, src_root, static):
-        dst = os.path.join(self.root, static.relpath)
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        shutil.copy2(os.path.join(src_root, static.relpath), dst)
+    def write_static(self, page):
+        self.output.copy_file(page.relpath, page.abspath)
 
-    def write_page(self, src_root, page):
-        writer = BodyNikola(page)
-        page.parse_body(writer)
+    def write_markdown(self, page):
+        writer = BodyNikola()
+        writer.read(page)
         if writer.is_empty():
             return
 
-        dst = os.path.join(self.root, page.relpath + ".md")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        with open(dst, "wt") as out:
+        with self.output.open(page.relpath_without_extension + ".md") as out:
             print("<!--", file=out)
             if page.title is not None:
                 print(".. title: {}".format(page.title), file=out)
             if page.tags:
                 print(".. tags: {}".format(", ".join(sorted(page.tags))), file=out)
             if page.date is not None:
-                tz = tzlocal()
-                ts = page.date.astimezone(tz)
-                offset = tz.utcoffset(ts)
-                offset_sec = (offset.days * 24 * 3600 + offset.seconds)
-                offset_hrs = offset_sec // 3600
-                offset_min = offset_sec % 3600
-                if offset:
-                    tz_str = ' UTC{0:+03d}:{1:02d}'.format(offset_hrs, offset_min // 60)
-                else:
-                    tz_str = ' UTC'
-                print(".. date: {}".format(ts.strftime("%Y-%m-%d %H:%M:%S") + tz_str), file=out)
+                print(".. date: {}".format(dates.format_nikola(page.date)), file=out)
             print("-->", file=out)
             print(file=out)
             out.write("\n")
             writer.write(out)
-
@@ -0,0 +1,340 @@
+# coding: utf-8
+from .manifest import Manifest, manifest_path
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+import logging
+
+log = logging.getLogger()
+
+# Writes that can be pending for each output thread, before the writer waits
+# for the oldest one to finish
+QUEUE_PER_THREAD = 8
+
+
+class Output:
+    # Destination of the files generated by a writer, addressed by path
+    # relative to the root of the output tree
+    @contextlib.contextmanager
+    def open(self, relpath):
+        # Open relpath for writing as text
+        buf = io.StringIO()
+        yield buf
+        self.write_text(relpath, buf.getvalue())
+
+    def exists(self, relpath):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DirOutput(Output):
+    # Write output to a directory, only touching files whose contents changed,
+    # so that unchanged output keeps its mtime.
+    #
+    # Generated files are compared with the hashes in the manifest of the
+    # previous run, so that they are not read back: a file is left alone if
+    # it has the same hash, and the same size and mtime that the manifest
+    # recorded. Without a manifest, all files are written.
+    #
+    # With threads, files are written by a pool of background threads while
+    # the writer goes on rendering. When QUEUE_PER_THREAD * threads writes are
+    # pending, the writer waits for the oldest one. Errors are raised in the
+    # order the writes were queued, and flush() waits for all pending writes.
+    def __init__(self, root, threads=0):
+        self.root = root
+        self.threads = threads
+        self.pool = None
+
+        # relpaths of all the files written, for the manifest
+        self.written = set()
+
+        # Manifest of the previous run
+        try:
+            self.previous = Manifest.load(manifest_path(root))
+        except FileNotFoundError:
+            self.previous = None
+
+        # relpath -> manifest entry of the generated files, so that the new
+        # manifest does not need to hash them again
+        self.hashes = {}
+
+        # Futures of the pending writes, oldest first
+        self.pending = collections.deque()
+
+        # relpath -> future of its last queued write
+        self.queued = {}
+
+    def submit(self, func, relpath, *args):
+        self.written.add(relpath)
+        if not self.threads:
+            func(relpath, *args)
+            return
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix="output")
+
+        # Writes to the same file must not run concurrently
+        previous = self.queued.get(relpath)
+        if previous is not None:
+            concurrent.futures.wait([previous])
+
+        # Report the errors of completed writes, and wait for the oldest one
+        # if the queue is full
+        limit = self.threads * QUEUE_PER_THREAD
+        while self.pending and (self.pending[0].done() or len(self.pending) >= limit):
+            future = self.pending.popleft()
+            if future.exception() is not None:
+                # Do not leave writes running after the error is raised
+                with contextlib.suppress(Exception):
+                    self.flush()
+                future.result()
+
+        future = self.pool.submit(func, relpath, *args)
+        self.pending.append(future)
+        self.queued[relpath] = future
+
+    def abspath(self, relpath):
+        abspath = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(abspath), exist_ok=True)
+        return abspath
+
+    def exists(self, relpath):
+        return relpath in self.queued or os.path.exists(os.path.join(self.root, relpath))
+
+    def write_text(self, relpath, text):
+        self.submit(self.do_write_text, relpath, text)
+
+    def copy_file(self, relpath, src):
+        self.submit(self.do_copy_file, relpath, src)
+
+    def do_write_text(self, relpath, text):
+        dst = self.abspath(relpath)
+        data = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        old = self.previous.files.get(relpath) if self.previous is not None else None
+        if old is not None and old["sha256"] == digest:
+            try:
+                st = os.stat(dst)
+            except FileNotFoundError:
+                st = None
+            if st is not None and st.st_size == old["size"] and st.st_mtime_ns == old["mtime_ns"]:
+                self.hashes[relpath] = old
+                return
+        with open(dst, "wb") as out:
+            out.write(data)
+        st = os.stat(dst)
+        self.hashes[relpath] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+
+    def do_copy_file(self, relpath, src):
+        dst = self.abspath(relpath)
+        # copy2 preserves mtime, so same size and mtime means same file
+        st_src = os.stat(src)
+        try:
+            st_dst = os.stat(dst)
+        except FileNotFoundError:
+            st_dst = None
+        if st_dst is not None and st_dst.st_size == st_src.st_size and st_dst.st_mtime_ns == st_src.st_mtime_ns:
+            return
+        shutil.copy2(src, dst)
+
+    def flush(self):
+        # Wait for all pending writes, then raise the error of the first one
+        # that failed
+        error = None
+        while self.pending:
+            future = self.pending.popleft()
+            if error is None:
+                error = future.exception()
+            else:
+                concurrent.futures.wait([future])
+        self.queued = {}
+        if error is not None:
+            raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+def source_date_epoch():
+    # Timestamp used for all archive members, so that archives are
+    # reproducible
+    return int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+
+
+class ArchiveOutput(Output):
+    # Write output to an archive, without creating the output tree on disk.
+    #
+    # Each file is added to the archive as soon as it is written, with fixed
+    # timestamps and permissions, so nothing is kept in memory. Members are in
+    # the order the writer generates them, which only depends on the site, so
+    # that the same output gives the same archive. Writes are serialized with
+    # a lock, so writers can use the output from several threads. The archive
+    # is written to a temporary file, renamed into place by close().
+    def __init__(self, pathname):
+        self.pathname = pathname
+        self.tmp = pathname + ".tmp"
+        self.mtime = source_date_epoch()
+        self.lock = threading.Lock()
+        self.started = False
+
+        # relpaths of the members added so far
+        self.members = set()
+
+    def add(self, relpath, data=None, src=None):
+        with self.lock:
+            if relpath in self.members:
+                # The member cannot be replaced in a stream: add it again, and
+                # extracting the archive keeps the last one, as a directory
+                # output would
+                log.warn("%s: %s is written more than once", self.pathname, relpath)
+            self.members.add(relpath)
+            if not self.started:
+                self.start()
+                self.started = True
+            self.add_member(relpath, data, src)
+
+    def exists(self, relpath):
+        return relpath in self.members
+
+    def write_text(self, relpath, text):
+        self.add(relpath, data=text.encode())
+
+    def copy_file(self, relpath, src):
+        self.add(relpath, src=src)
+
+    def close(self):
+        with self.lock:
+            if not self.started:
+                self.start()
+            self.started = False
+            self.finish()
+        os.replace(self.tmp, self.pathname)
+        self.members = set()
+
+
+def zstd_compressor():
+    # Return a function wrapping a binary stream with a zstd compressor
+    try:
+        from compression import zstd
+        return lambda out: zstd.ZstdFile(out, "wb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression needs Python 3.14 or the zstandard module")
+    return lambda out: zstandard.ZstdCompressor().stream_writer(out, closefd=True)
+
+
+class TarOutput(ArchiveOutput):
+    def __init__(self, pathname, compression=None):
+        super().__init__(pathname)
+        # None, "gz" or "zst"
+        self.compression = compression
+        if compression == "zst":
+            # Fail early if zstd is not available
+            self.zstd = zstd_compressor()
+        elif compression not in (None, "gz"):
+            raise RuntimeError("unsupported tar compression {}".format(compression))
+
+    def open_stream(self, out):
+        if self.compression == "gz":
+            # Do not store name and time in the gzip header
+            return gzip.GzipFile(filename="", mode="wb", fileobj=out, mtime=0)
+        if self.compression == "zst":
+            return self.zstd(out)
+        return out
+
+    def tarinfo(self, relpath, type=tarfile.REGTYPE, mode=0o644, size=0):
+        info = tarfile.TarInfo(relpath)
+        info.type = type
+        info.mode = mode
+        info.size = size
+        info.mtime = self.mtime
+        return info
+
+    def start(self):
+        self.out = open(self.tmp, "wb")
+        self.stream = self.open_stream(self.out)
+        self.tar = tarfile.open(fileobj=self.stream, mode="w", format=tarfile.GNU_FORMAT)
+        self.dirs = set()
+
+    def add_member(self, relpath, data, src):
+        # Add entries for the directories, before their contents
+        parent = os.path.dirname(relpath)
+        missing = []
+        while parent and parent not in self.dirs:
+            missing.append(parent)
+            self.dirs.add(parent)
+            parent = os.path.dirname(parent)
+        for d in reversed(missing):
+            self.tar.addfile(self.tarinfo(d, tarfile.DIRTYPE, 0o755))
+
+        if data is not None:
+            self.tar.addfile(self.tarinfo(relpath, size=len(data)), io.BytesIO(data))
+        else:
+            with open(src, "rb") as fd:
+                self.tar.addfile(self.tarinfo(relpath, size=os.fstat(fd.fileno()).st_size), fd)
+
+    def finish(self):
+        try:
+            self.tar.close()
+            self.stream.close()
+        finally:
+            self.out.close()
+
+
+class ZipOutput(ArchiveOutput):
+    def zipinfo(self, relpath):
+        # zip cannot store dates before 1980
+        date_time = time.gmtime(max(self.mtime, 315532800))[:6]
+        info = zipfile.ZipInfo(relpath, date_time=date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        return info
+
+    def start(self):
+        self.zf = zipfile.ZipFile(self.tmp, "w")
+
+    def add_member(self, relpath, data, src):
+        if data is not None:
+            self.zf.writestr(self.zipinfo(relpath), data)
+        else:
+            with open(src, "rb") as fd, self.zf.open(self.zipinfo(relpath), "w") as out:
+                shutil.copyfileobj(fd, out, 1024 * 1024)
+
+    def finish(self):
+        self.zf.close()
+
+
+def archive_output(pathname):
+    # Create an archive output, choosing the format from the file name
+    if pathname.endswith(".zip"):
+        return ZipOutput(pathname)
+    if pathname.endswith(".tar"):
+        return TarOutput(pathname)
+    if pathname.endswith((".tar.gz", ".tgz")):
+        return TarOutput(pathname, "gz")
+    if pathname.endswith((".tar.zst", ".tzst")):
+        return TarOutput(pathname, "zst")
+    raise RuntimeError("cannot guess the archive format of {}".format(pathname))
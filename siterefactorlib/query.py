@@ -0,0 +1,141 @@
+# coding: utf-8
+from . import content
+import bisect
+
+
+def date_key(page):
+    # Sort key for pages, newest first
+    return (-page.date.timestamp(), page.relpath)
+
+
+class SiteIndex:
+    # Secondary indexes on the pages of a site, kept up to date as pages are
+    # added, scanned and relocated
+    def __init__(self):
+        # tag -> list of pages, newest first
+        self.by_tag = {}
+
+        # (year, month) -> list of pages, newest first
+        self.by_month = {}
+
+        # TYPE -> {relpath: page}
+        self.by_type = {}
+
+        # Sorted list of all relpaths, for prefix searches
+        self.relpaths = []
+
+        # relpath -> page
+        self.pages = {}
+
+        # Pages with links or images that cannot be resolved
+        self.unresolved = set()
+
+    def add(self, page):
+        self.pages[page.relpath] = page
+        bisect.insort(self.relpaths, page.relpath)
+        self.by_type.setdefault(page.TYPE, {})[page.relpath] = page
+        if page.date is not None:
+            for tag in page.tags:
+                bisect.insort(self.by_tag.setdefault(tag, []), page, key=date_key)
+            bisect.insort(self.by_month.setdefault((page.date.year, page.date.month), []), page, key=date_key)
+        for el in getattr(page, "body", ()):
+            if isinstance(el, (content.InternalLink, content.InlineImage)) and el.target is None:
+                self.unresolved.add(page)
+                break
+
+    def _remove_sorted(self, index, name, page):
+        pages = index.get(name)
+        if not pages:
+            return
+        pos = bisect.bisect_left(pages, date_key(page), key=date_key)
+        if pos < len(pages) and pages[pos] is page:
+            del pages[pos]
+        else:
+            pages.remove(page)
+        if not pages:
+            del index[name]
+
+    def remove(self, page):
+        if self.pages.get(page.relpath) is not page:
+            return
+        del self.pages[page.relpath]
+        pos = bisect.bisect_left(self.relpaths, page.relpath)
+        del self.relpaths[pos]
+        del self.by_type[page.TYPE][page.relpath]
+        if page.date is not None:
+            for tag in page.tags:
+                self._remove_sorted(self.by_tag, tag, page)
+            self._remove_sorted(self.by_month, (page.date.year, page.date.month), page)
+        self.unresolved.discard(page)
+
+    def under(self, prefix):
+        # Return the pages whose relpath starts with prefix
+        pos = bisect.bisect_left(self.relpaths, prefix)
+        res = []
+        for relpath in self.relpaths[pos:]:
+            if not relpath.startswith(prefix):
+                break
+            res.append(self.pages[relpath])
+        return res
+
+    def in_year(self, year):
+        res = []
+        for month in range(12, 0, -1):
+            res.extend(self.by_month.get((year, month), ()))
+        return res
+
+
+class Query:
+    # Composable query on the pages of a site. Each filter is answered by an
+    # index, and results are computed by intersecting the candidates starting
+    # from the smallest set. Queries are immutable: filters return a new
+    # query.
+    #
+    # Example: site.query().tag("debian").year(2015).under("blog/").order_by_date()
+    def __init__(self, index, candidates=(), order=None):
+        self.index = index
+        # Lists of candidate pages, one per filter
+        self.candidates = list(candidates)
+        # None, or True/False for newest/oldest first
+        self.order = order
+
+    def _filter(self, pages):
+        return Query(self.index, self.candidates + [pages], self.order)
+
+    def tag(self, tag):
+        return self._filter(self.index.by_tag.get(tag, ()))
+
+    def year(self, year, month=None):
+        if month is None:
+            return self._filter(self.index.in_year(year))
+        return self._filter(self.index.by_month.get((year, month), ()))
+
+    def under(self, prefix):
+        return self._filter(self.index.under(prefix))
+
+    def type(self, TYPE):
+        return self._filter(list(self.index.by_type.get(TYPE, {}).values()))
+
+    def unresolved(self):
+        return self._filter(list(self.index.unresolved))
+
+    def order_by_date(self, newest_first=True):
+        return Query(self.index, self.candidates, newest_first)
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def all(self):
+        if not self.candidates:
+            res = list(self.index.pages.values())
+        else:
+            candidates = sorted(self.candidates, key=len)
+            others = [set(c) for c in candidates[1:]]
+            res = [p for p in candidates[0] if all(p in s for s in others)]
+        if self.order is not None:
+            res.sort(key=lambda p: (p.date.timestamp() if p.date is not None else float("-inf"), p.relpath),
+                     reverse=self.order)
+        return res
+
+    def count(self):
+        return len(self.all())
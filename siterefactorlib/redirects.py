@@ -0,0 +1,49 @@
+# coding: utf-8
+from urllib.parse import quote
+
+# Supported redirect map formats, and the name of the file they are written to
+FORMATS = {
+    # nginx map, to include in the http block
+    "nginx": "redirects.nginx.map",
+    # Apache RewriteMap in txt format. It can be converted to dbm with
+    # httxt2dbm
+    "apache": "redirects.apache.txt",
+    # _redirects file, as used by Netlify and similar hosting services
+    "netlify": "_redirects",
+}
+
+
+def redirect_map(site, url):
+    # Return the sorted list of (old URL, new URL) for all the aliases of the
+    # pages in the site. url(relpath, page) returns the URL of the given relpath
+    # when it is the location of page
+    res = {}
+    for page in site.pages.values():
+        dest = url(page.relpath, page)
+        for relpath in page.aliases:
+            src = url(relpath, page)
+            if src != dest:
+                res[src] = dest
+    return sorted(res.items())
+
+
+def render(redirects, format):
+    # Render a redirect map in one of FORMATS
+    lines = []
+    if format == "nginx":
+        # Use with: if ($redirect_uri) { return 301 $redirect_uri; }
+        lines.append("map $uri $redirect_uri {")
+        for src, dest in redirects:
+            lines.append('    "{}" "{}";'.format(
+                src.replace("\\", "\\\\").replace('"', '\\"'), quote(dest)))
+        lines.append("}")
+    elif format == "apache":
+        # Use with: RewriteMap redirects txt:/path/redirects.apache.txt
+        for src, dest in redirects:
+            lines.append("{} {}".format(quote(src), quote(dest)))
+    elif format == "netlify":
+        for src, dest in redirects:
+            lines.append("{} {} 301".format(quote(src), quote(dest)))
+    else:
+        raise ValueError("unsupported redirect map format {}".format(format))
+    return "\n".join(lines) + "\n"
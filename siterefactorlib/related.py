@@ -0,0 +1,214 @@
+# coding: utf-8
+import hashlib
+import json
+import logging
+
+log = logging.getLogger()
+
+# Weight of shared tags and of shared words in the similarity between pages
+TAG_WEIGHT = 0.5
+TEXT_WEIGHT = 0.5
+
+# Number of pages compared with all the others in one matrix product
+BATCH_SIZE = 256
+
+# Version of the cache format, to change when the way scores are computed
+# changes
+CACHE_VERSION = 2
+
+# Recompute all rows when document frequencies changed by more than this
+# fraction since all rows were last computed, or after this many builds that
+# only recomputed some rows
+MAX_DF_DRIFT = 0.05
+MAX_INCREMENTAL_BUILDS = 20
+
+
+def df_drift(old, new):
+    # Fraction by which the document frequencies in new differ from those in
+    # old: both are {"docs": count, "df": {term: count}}
+    docs = abs(new["docs"] - old["docs"]) / max(old["docs"], 1)
+    terms = set(old["df"]).union(new["df"])
+    changed = sum(abs(new["df"].get(t, 0) - old["df"].get(t, 0)) for t in terms)
+    return max(docs, changed / max(sum(old["df"].values()), 1))
+
+
+class RelatedPages:
+    # For each page, the pages most similar to it by tags and by TF-IDF of
+    # their words.
+    #
+    # Each page is a row of a sparse matrix, made of its L2-normalized tag
+    # vector and TF-IDF term vector, each scaled by the square root of its
+    # weight: the product of two rows is then the weighted sum of their cosine
+    # similarities. Rows are compared with all the others in batches.
+    #
+    # Only the rows of pages whose tags or words changed since the last build
+    # are recomputed, together with the rows that listed a changed or removed
+    # page. The other rows are kept from the cache, and updated with the
+    # scores of the changed pages. Scores in kept rows use the IDF weights and
+    # norms of the build that computed them, so that all rows are recomputed
+    # once the document frequencies drift by more than MAX_DF_DRIFT from those
+    # of the last full computation, or after MAX_INCREMENTAL_BUILDS partial
+    # ones.
+    def __init__(self, cache, count=5):
+        # Number of related pages for each page
+        self.count = count
+
+        # {"options": ..., "rows": {relpath: [signature, [[relpath, score], ...]]},
+        #  "base": ..., "builds": ...} from the previous build
+        self.old = cache
+
+        # relpath -> [signature, [[relpath, score], ...]] for this build
+        self.rows = {}
+
+        # Document frequencies of the last build that computed all rows, as
+        # {"docs": count, "df": {term: count}}, and number of partial builds
+        # since then
+        self.base = None
+        self.builds = 0
+
+        self.count_computed = 0
+
+    @property
+    def options(self):
+        return [CACHE_VERSION, self.count, TAG_WEIGHT, TEXT_WEIGHT]
+
+    def signature(self, tags, terms):
+        return hashlib.sha256(json.dumps([tags, terms]).encode()).hexdigest()[:16]
+
+    def to_cache(self):
+        return {"options": self.options, "rows": self.rows, "base": self.base, "builds": self.builds}
+
+    def neighbours(self, relpath):
+        # Return the relpaths of the pages related to relpath, most similar
+        # first
+        row = self.rows.get(relpath)
+        if row is None:
+            return []
+        return [r for r, score in row[1]]
+
+    def build(self, docs):
+        # Compute the related pages of docs, a dict mapping relpaths to their
+        # (tags, terms) lists
+        relpaths = sorted(docs)
+        signatures = {r: self.signature(*docs[r]) for r in relpaths}
+
+        if self.old.get("options") == self.options:
+            old_rows = self.old["rows"]
+            self.base = self.old["base"]
+            self.builds = self.old["builds"]
+        else:
+            old_rows = {}
+
+        changed = set(r for r in relpaths if r not in old_rows or old_rows[r][0] != signatures[r])
+        stale = changed.union(r for r in old_rows if r not in docs)
+        if not stale:
+            self.rows = old_rows
+            return
+
+        frequencies = self.frequencies(docs)
+        if old_rows and self.builds < MAX_INCREMENTAL_BUILDS and df_drift(self.base, frequencies) <= MAX_DF_DRIFT:
+            self.builds += 1
+        else:
+            if old_rows:
+                log.info("Related pages: cached scores are too old, recomputing all pages")
+            old_rows = {}
+            changed = set(relpaths)
+            self.base = frequencies
+            self.builds = 0
+
+        # Rows that need to be computed from scratch
+        recompute = []
+        for i, relpath in enumerate(relpaths):
+            if relpath in changed or any(r in stale for r, score in old_rows[relpath][1]):
+                recompute.append(i)
+
+        import numpy
+
+        matrix = self.matrix(relpaths, docs)
+        recomputed = set(recompute)
+
+        # Scores of the changed pages, for the rows that are kept
+        extra = {}
+        for start in range(0, len(recompute), BATCH_SIZE):
+            batch = recompute[start:start + BATCH_SIZE]
+            scores = (matrix[batch] @ matrix.T).toarray()
+            for i, row in zip(batch, scores):
+                row[i] = 0
+                row = numpy.round(row, 6)
+                relpath = relpaths[i]
+                self.rows[relpath] = [signatures[relpath], self.top(row, relpaths)]
+                if relpath not in changed:
+                    continue
+                for j in numpy.flatnonzero(row > 0).tolist():
+                    if j not in recomputed:
+                        extra.setdefault(j, []).append([relpath, float(row[j])])
+            self.count_computed += len(batch)
+
+        for j, relpath in enumerate(relpaths):
+            if j in recomputed:
+                continue
+            row = old_rows[relpath][1] + extra.get(j, [])
+            row.sort(key=lambda x: (-x[1], x[0]))
+            self.rows[relpath] = [signatures[relpath], row[:self.count]]
+
+    def frequencies(self, docs):
+        # Number of documents and document frequency of each term
+        df = {}
+        for tags, terms in docs.values():
+            for term in set(terms):
+                df[term] = df.get(term, 0) + 1
+        return {"docs": len(docs), "df": df}
+
+    def top(self, scores, relpaths):
+        # Return the [relpath, score] of the highest scores, sorted by
+        # decreasing score and then by relpath
+        import numpy
+
+        # Round first, so that scores differing only by floating point error
+        # compare equal
+        scores = numpy.round(scores, 6)
+        if len(scores) > self.count:
+            # Take all the scores at least as high as the count-th highest,
+            # so that ties are broken by relpath and not by argpartition
+            threshold = scores[numpy.argpartition(-scores, self.count - 1)[self.count - 1]]
+            candidates = numpy.flatnonzero(scores >= threshold)
+        else:
+            candidates = range(len(scores))
+        res = [[relpaths[i], float(scores[i])] for i in candidates if scores[i] > 0]
+        res.sort(key=lambda x: (-x[1], x[0]))
+        return res[:self.count]
+
+    def matrix(self, relpaths, docs):
+        # Build the sparse matrix with one row for each page
+        import numpy
+        import scipy.sparse
+
+        def vectors(field):
+            # Binary page/feature matrix for docs[relpath][field]
+            ids = {}
+            rows = []
+            cols = []
+            for i, relpath in enumerate(relpaths):
+                for feature in docs[relpath][field]:
+                    rows.append(i)
+                    cols.append(ids.setdefault(feature, len(ids)))
+            return scipy.sparse.csr_matrix(
+                    (numpy.ones(len(rows)), (rows, cols)), shape=(len(relpaths), len(ids)))
+
+        def normalize(m):
+            norms = numpy.sqrt(numpy.asarray(m.multiply(m).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            return scipy.sparse.diags(1 / norms) @ m
+
+        tags = vectors(0)
+        terms = vectors(1)
+
+        # Smoothed inverse document frequency of each term
+        df = numpy.asarray(terms.sum(axis=0)).ravel()
+        idf = numpy.log((1 + len(relpaths)) / (1 + df)) + 1
+        terms = terms @ scipy.sparse.diags(idf)
+
+        return scipy.sparse.hstack([
+            numpy.sqrt(TAG_WEIGHT) * normalize(tags),
+            numpy.sqrt(TEXT_WEIGHT) * normalize(terms),
+        ]).tocsr()
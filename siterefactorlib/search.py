@@ -0,0 +1,142 @@
+# coding: utf-8
+from . import content
+import json
+import os
+import re
+import time
+
+# Regular expression matching the words to index
+re_word = re.compile(r"\w{2,}")
+
+# Number of leading characters of a term used to choose its shard
+SHARD_PREFIX = 2
+
+# Client side code to query the index. search(query) returns a promise for the
+# list of [url, title] of the documents that contain all the words in query
+LOADER_JS = """// Generated by siterefactor
+const siterefactorSearch = (function() {
+  const base = new URL(".", document.currentScript.src);
+  const shards = {};
+  let docs = null;
+
+  async function load(name) {
+    const res = await fetch(new URL(name, base));
+    return res.ok ? res.json() : {};
+  }
+
+  async function postings(term) {
+    const prefix = term.substr(0, %(prefix)d);
+    if (!(prefix in shards)) shards[prefix] = load("shard-" + encodeURIComponent(prefix) + ".json");
+    const deltas = (await shards[prefix])[term] || [];
+    // Postings are delta-encoded
+    let id = 0;
+    return deltas.map(d => id += d);
+  }
+
+  return async function search(query) {
+    if (docs === null) docs = load("docs.json");
+    const terms = query.toLowerCase().match(/[\\p{L}\\p{N}_]{2,}/gu) || [];
+    let ids = null;
+    for (const term of terms) {
+      const found = new Set(await postings(term));
+      ids = ids === null ? found : new Set([...ids].filter(x => found.has(x)));
+    }
+    const list = await docs;
+    return ids === null ? [] : [...ids].map(id => list[id]);
+  };
+})();
+""" % {"prefix": SHARD_PREFIX}
+
+
+class SearchIndex:
+    def __init__(self, cache):
+        # relpath -> [mtime_ns, size, terms] from the previous build
+        self.old_terms = cache
+
+        # relpath -> [mtime_ns, size, terms] for this build
+        self.terms = {}
+
+        # relpath -> (url, title) of indexed documents
+        self.docs = {}
+
+        self.count_tokenized = 0
+
+        # Time spent building the index
+        self.elapsed = 0.0
+
+    def tokenize(self, page):
+        words = set()
+        if page.title:
+            words.update(re_word.findall(page.title.lower()))
+        in_code = False
+        for el in page.body:
+            if isinstance(el, content.CodeBegin):
+                in_code = True
+            elif isinstance(el, content.CodeEnd):
+                in_code = False
+            elif in_code:
+                continue
+            elif isinstance(el, content.Text):
+                words.update(re_word.findall(el.text.lower()))
+            elif isinstance(el, content.Line):
+                words.update(re_word.findall(el.line.lower()))
+        return sorted(words)
+
+    def page_terms(self, page):
+        # Return the terms of a page. Only tokenize pages whose source changed
+        # since the last build
+        current = self.terms.get(page.relpath)
+        if current is not None:
+            return current[2]
+        start = time.perf_counter()
+        st = os.stat(os.path.join(page.site.root, page.orig_relpath))
+        cached = self.old_terms.get(page.relpath)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            terms = cached[2]
+        else:
+            terms = self.tokenize(page)
+            self.count_tokenized += 1
+        self.terms[page.relpath] = [st.st_mtime_ns, st.st_size, terms]
+        self.elapsed += time.perf_counter() - start
+        return terms
+
+    def add(self, page, url):
+        self.page_terms(page)
+        self.docs[page.relpath] = (url, page.title or page.relpath_without_extension)
+
+    def add_terms(self, relpath, url, title, terms):
+        # Add a document already tokenized elsewhere, like in a shard of a
+        # sharded build
+        self.terms[relpath] = [None, None, terms]
+        self.docs[relpath] = (url, title)
+
+    def build(self):
+        # Return a dict mapping file names to the JSON data to write for the
+        # index
+        start = time.perf_counter()
+
+        # Sort documents by relpath, so that ids are stable across builds
+        relpaths = sorted(self.docs.keys())
+
+        # Build the inverted index. Since documents are added in id order, the
+        # postings lists come out sorted
+        index = {}
+        for docid, relpath in enumerate(relpaths):
+            for term in self.terms[relpath][2]:
+                index.setdefault(term, []).append(docid)
+
+        shards = {}
+        for term, postings in index.items():
+            # Delta-encode postings, to keep numbers small
+            deltas = [postings[0]]
+            deltas.extend(b - a for a, b in zip(postings, postings[1:]))
+            shards.setdefault(term[:SHARD_PREFIX], {})[term] = deltas
+
+        res = {"docs.json": [self.docs[r] for r in relpaths]}
+        for prefix, terms in shards.items():
+            res["shard-" + prefix + ".json"] = terms
+        self.elapsed += time.perf_counter() - start
+        return res
+
+    def encode(self, data):
+        return json.dumps(data, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,102 @@
+# coding: utf-8
+import datetime
+import json
+import os
+import re
+import zlib
+
+re_year_dir = re.compile(r"^(?:blog/)?(\d{4})/")
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+def shard_of(relpath, count, by="hash"):
+    # Return the shard a page belongs to. This only depends on the relpath,
+    # so it is the same in every process and on every machine
+    if by == "year":
+        mo = re_year_dir.match(relpath)
+        if mo:
+            return int(mo.group(1)) % count
+    elif by != "hash":
+        raise ShardError("unsupported shard criterion {}".format(by))
+    return zlib.crc32(relpath.encode()) % count
+
+
+def parse_shard(spec):
+    # Parse a K/N shard specification
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ShardError("shard {} is not in the form K/N".format(spec))
+    if count < 1 or not 0 <= index < count:
+        raise ShardError("shard {} is out of range".format(spec))
+    return index, count
+
+
+def manifest_path(root, index):
+    return os.path.join(root, "web.shard-{}.json".format(index))
+
+
+class ShardPage:
+    # Markdown page of a shard, as recorded in its partial manifest. Pages
+    # with no content have no links, html and terms
+    TYPE = "markdown"
+
+    def __init__(self, relpath, info):
+        self.relpath = relpath
+        self.url = info["url"]
+        self.title = info["title"]
+        self.tags = set(info["tags"])
+        self.date = datetime.datetime.fromisoformat(info["date"]) if info["date"] is not None else None
+        self.links = info["links"]
+        self.html = info.get("html")
+        self.terms = info["terms"]
+
+    @property
+    def relpath_without_extension(self):
+        return os.path.splitext(self.relpath)[0]
+
+
+def write_manifest(root, index, count, pages, files, diagnostics):
+    # Write the partial manifest of a shard
+    data = {
+        "shard": index,
+        "count": count,
+        "pages": pages,
+        "files": sorted(files),
+        "diagnostics": diagnostics.to_list(),
+    }
+    pathname = manifest_path(root, index)
+    with open(pathname + ".tmp", "wt") as out:
+        json.dump(data, out)
+    os.replace(pathname + ".tmp", pathname)
+
+
+def load_manifests(root, count, diagnostics):
+    # Load the partial manifests of all shards, returning the list of
+    # ShardPage and a dict mapping each output file to the shard that
+    # generated it. The problems found by the shards are merged into
+    # diagnostics. Raises ShardError if a shard is missing or if two shards
+    # generated the same file
+    pages = []
+    files = {}
+    for index in range(count):
+        pathname = manifest_path(root, index)
+        try:
+            with open(pathname, "rt") as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            raise ShardError("shard {}/{} has not been built: {} not found".format(index, count, pathname))
+        if data["count"] != count:
+            raise ShardError("{} was built for {} shards instead of {}".format(pathname, data["count"], count))
+        for relpath in data["files"]:
+            other = files.get(relpath)
+            if other is not None:
+                raise ShardError("{} is generated by both shard {} and shard {}".format(relpath, other, index))
+            files[relpath] = index
+        for relpath, info in data["pages"].items():
+            pages.append(ShardPage(relpath, info))
+        diagnostics.merge(data["diagnostics"])
+    return pages, files
@@ -1,6 +1,9 @@
 # coding: utf-8
 
-from .core import BodyWriter, MarkdownPage
+from .core import BodyWriter, MarkdownPage, type_dispatch
+from .manifest import write_manifest
+from .output import DirOutput
+from . import redirects
 import json
 import os
 import re
@@ -23,17 +26,17 @@ class SSiteMarkdown(BodyWriter):
         if el.target is None:
             self.chunks.append("(missing image: {alt})".format(alt=el.text))
         else:
-            path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath)
             self.chunks.append('![{alt}]({fname})'.format(fname=path, alt=el.text))
 
     def generate_internallink(self, el):
         if el.target is None:
             if el.text is None:
-                log.warn("%s:%s: found link with no text and unresolved target", el.page.relpath, el.lineno)
+                el.page.site.diagnostics.add("empty-link", el.page.relpath, el.lineno)
             else:
                 self.chunks.append(el.text)
         elif el.target.TYPE == "markdown":
-            path = os.path.relpath(el.target.relpath_without_extension, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath_without_extension)
             if path.startswith("../"):
                 path = el.target.relpath_without_extension
             if el.text is None or el.text == path:
@@ -41,7 +44,7 @@ class SSiteMarkdown(BodyWriter):
             else:
                 self.chunks.append('[{text}]({target})'.format(text=el.text, target=path))
         else:
-            path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath)
             if path.startswith("../"):
                 path = el.target.relpath
             if el.text is None:
@@ -55,14 +58,16 @@ class SSiteMarkdown(BodyWriter):
 
 
 class SSiteWriter:
-    def __init__(self, root):
+    def __init__(self, root, redirects=None, output=None, threads=0):
         # Root directory of the destination
         self.root = root
 
-    def output_abspath(self, relpath):
-        abspath = os.path.join(self.root, "site", relpath)
-        os.makedirs(os.path.dirname(abspath), exist_ok=True)
-        return abspath
+        # Where the site tree is written
+        self.output = output if output is not None else DirOutput(os.path.join(root, "site"), threads)
+
+        # Format of the redirect map for page aliases, one of
+        # redirects.FORMATS, or None to not write it
+        self.redirects = redirects
 
     def write(self, site):
         # Remove leading spaces from markdown content
@@ -72,8 +77,16 @@ class SSiteWriter:
                 page.body.pop(0)
 
         # Generate output
+        write = type_dispatch(self, "write_")
         for page in site.pages.values():
-            getattr(self, "write_" + page.TYPE)(page)
+            write[page.TYPE](page)
+
+        if self.redirects is not None:
+            self.write_redirects(site)
+
+        self.output.close()
+        if isinstance(self.output, DirOutput):
+            write_manifest(self.output.root, self.output.written, self.output.hashes)
 
         ## Generate tag indices
         #tags = set()
@@ -97,9 +110,27 @@ class SSiteWriter:
         #    print('[[!pagestats pages="tags/*"]]', file=out)
         #    print('[[!inline pages="tags/*"]]', file=out)
 
+    def alias_url(self, relpath, page):
+        # staticsite renders markdown pages as directories
+        if page.TYPE == "markdown":
+            return "/" + os.path.splitext(relpath)[0] + "/"
+        else:
+            return "/" + relpath
+
+    def write_redirects(self, site):
+        # Write a single redirect map for all aliases. A _redirects file is
+        # copied by staticsite to its output, while server configuration goes
+        # outside the site
+        text = redirects.render(redirects.redirect_map(site, self.alias_url), self.redirects)
+        name = redirects.FORMATS[self.redirects]
+        if self.redirects == "netlify":
+            self.output.write_text(name, text)
+        else:
+            with open(os.path.join(self.root, name), "wt") as out:
+                out.write(text)
+
     def write_static(self, page):
-        dst = self.output_abspath(page.relpath)
-        shutil.copy2(page.abspath, dst)
+        self.output.copy_file(page.relpath, page.abspath)
 
     def write_markdown(self, page):
         writer = SSiteMarkdown()
@@ -115,8 +146,7 @@ class SSiteWriter:
         if page.date is not None:
             meta["date"] = page.date.strftime("%Y-%m-%d")
 
-        dst = self.output_abspath(page.relpath_without_extension + ".md")
-        with open(dst, "wt") as out:
+        with self.output.open(page.relpath_without_extension + ".md") as out:
             json.dump(meta, out, indent=2)
             print(file=out)
             if page.title is not None:
@@ -124,8 +154,3 @@ class SSiteWriter:
                 print(file=out)
             writer.write(out)
 
-        #for relpath in page.aliases:
-        #    dst = os.path.join(self.root, relpath)
-        #    os.makedirs(os.path.dirname(dst), exist_ok=True)
-        #    with open(dst, "wt") as out:
-        #        print('[[!meta redir="{relpath}"]]'.format(relpath=page.relpath_without_extension), file=out)
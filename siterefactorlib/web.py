@@ -1,20 +1,73 @@
 # coding: utf-8
 
-from .core import BodyWriter, MarkdownPage
+from .core import BodyWriter, MarkdownPage, type_dispatch
+from .feeds import AtomFeeds
+from .search import SearchIndex, LOADER_JS
+from .related import RelatedPages
+from . import compress
+from . import content
+from .images import ImageDerivatives, RESIZABLE
+from .highlight import HighlightCache
+from .manifest import write_manifest, MANIFEST_NAME
+from .output import DirOutput
+from .assets import Assets
+from .query import date_key
+from . import shards
+from . import redirects
+import datetime
 import json
+import html
+import heapq
 import os
 import re
 import shutil
+import urllib.parse
 import logging
 
 log = logging.getLogger()
 
+
+def href(path):
+    # Quote a relative URL path for use in an href attribute
+    return html.escape(urllib.parse.quote(path))
+
+
 class Webpage(BodyWriter):
+    def __init__(self, images=None, highlight=None):
+        super().__init__()
+        # ImageDerivatives with the resized versions of images, if any
+        self.images = images
+
+        # HighlightCache used to render code blocks. If None, code blocks are
+        # left to the codehilite markdown extension
+        self.highlight = highlight
+
+        # Language and position in chunks of the code block being read
+        self.code_lang = None
+        self.code_start = None
+
+    def read(self, page):
+        super().read(page)
+        # Leave an unterminated code block as it is
+        if self.code_start is not None:
+            self.chunks.insert(self.code_start, "```{lang}\n".format(lang=self.code_lang))
+            self.code_start = None
+
     def generate_codebegin(self, el):
-        self.chunks.append("```{lang}\n".format(lang=el.lang))
+        if self.highlight is None:
+            self.chunks.append("```{lang}\n".format(lang=el.lang))
+        else:
+            self.code_lang = el.lang
+            self.code_start = len(self.chunks)
 
     def generate_codeend(self, el):
-        self.chunks.append("```\n")
+        if self.code_start is None:
+            self.chunks.append("```\n")
+        else:
+            code = "".join(self.chunks[self.code_start:])
+            del self.chunks[self.code_start:]
+            self.chunks.append(self.highlight.stash(self.code_lang, code))
+            self.code_start = None
 
     def generate_ikiwikimap(self, el):
         self.chunks.append("[[!map {content}]]\n".format(content=el.content))
@@ -23,17 +76,27 @@ class Webpage(BodyWriter):
         if el.target is None:
             self.chunks.append("(missing image: {alt})".format(alt=el.text))
         else:
-            path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
-            self.chunks.append('[[!img {fname} alt="{alt}"]]'.format(fname=path, alt=el.text))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath)
+            if self.images is None or el.target.relpath not in self.images.variants:
+                self.chunks.append('![{alt}]({fname})'.format(fname=path, alt=el.text))
+                return
+            dest, info = self.images.variants[el.target.relpath]
+            img = '<img src="{src}" srcset="{srcset}" sizes="100vw" width="{width}" height="{height}" alt="{alt}">'.format(
+                src=html.escape(path), srcset=html.escape(self.images.srcset(el.target.relpath, path)),
+                width=info["width"], height=info["height"], alt=html.escape(el.text))
+            if info["webp"]:
+                img = '<picture><source type="image/webp" srcset="{srcset}">{img}</picture>'.format(
+                    srcset=html.escape(self.images.srcset(el.target.relpath, path, ".webp")), img=img)
+            self.chunks.append(img)
 
     def generate_internallink(self, el):
         if el.target is None:
             if el.text is None:
-                log.warn("%s:%s: found link with no text and unresolved target", el.page.relpath, el.lineno)
+                el.page.site.diagnostics.add("empty-link", el.page.relpath, el.lineno)
             else:
                 self.chunks.append(el.text)
         elif el.target.TYPE == "markdown":
-            path = os.path.relpath(el.target.relpath_without_extension, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath_without_extension)
             if path.startswith("../"):
                 path = el.target.relpath_without_extension
             if el.text is None or el.text == path:
@@ -41,7 +104,7 @@ class Webpage(BodyWriter):
             else:
                 self.chunks.append('[[{text}|{target}]]'.format(text=el.text, target=path))
         else:
-            path = os.path.relpath(el.target.relpath, os.path.dirname(el.page.relpath))
+            path = el.page.site.link_path(el.page.relpath, el.target.relpath)
             if path.startswith("../"):
                 path = el.target.relpath
             if el.text is None:
@@ -55,103 +118,626 @@ class Webpage(BodyWriter):
 
 
 class WebWriter:
-    def __init__(self, root):
+    # Number of pages listed in each page of a tag index
+    TAG_PAGE_SIZE = 10
+
+    # Number of entries in Atom feeds
+    FEED_SIZE = 15
+
+    # Number of related pages listed in each page
+    RELATED_SIZE = 5
+
+    def __init__(self, root, develop=False, site_url=None, precompress=False, resize_images=False, webp=False,
+                 shard=None, shard_by="hash", merge=None, redirects=None, output=None, fingerprint=False,
+                 threads=0, related=False, site_author=None, search_index=True):
         # Root directory of the destination
         self.root = root
 
-        # Markdown compiler
-        from markdown import Markdown
-        self.markdown = Markdown(
-            extensions=["markdown.extensions.extra", "markdown.extensions.codehilite"],
-            output_format="html5"
-        )
+        # Sharded builds: if shard is (index, count), only render the pages of
+        # that shard into web.shard-<index>, with a partial manifest. If merge
+        # is a number of shards, combine their output into web and generate
+        # the global indices
+        self.shard = shard
+        self.shard_by = shard_by
+        self.merge = merge
+
+        # Format of the redirect map for page aliases, one of
+        # redirects.FORMATS, or None to not write it
+        self.redirects = redirects
+
+        # Output to use instead of the web directory, like an archive
+        self.archive = output
 
-        # Jinja2 compiler
-        from jinja2 import Environment, FileSystemLoader
-        self.jinja2 = Environment(
-            loader=FileSystemLoader(os.path.join(self.root, "templates"))
-        )
+        # Number of background threads writing the output directory
+        self.threads = threads
 
-        self.page_template = self.jinja2.get_template("__page__.html")
+        # Write the client side search index in search/
+        self.search_index = search_index
+
+        # Pass the most similar pages to the page template, as related
+        self.related = related
+        self.related_pages = None
+
+        # Base URL of the site, used in feeds
+        self.site_url = site_url
+
+        # Author of the site, used in feeds. Defaults to the site name
+        self.site_author = site_author
+
+        # Write .gz and .br versions of compressible output
+        self.precompress = precompress
+
+        # Generate resized versions of images, and optionally WebP versions
+        self.resize_images = resize_images
+        self.webp = webp
+
+        # Write copies of static files with their content hash in the name,
+        # used by the asset() template function
+        self.fingerprint = fingerprint
+        self.assets = None
+
+        # Directory used to keep data across builds. Shards keep separate
+        # caches, so that they can run at the same time
+        if shard is None:
+            self.cachedir = os.path.join(self.root, "cache")
+        else:
+            self.cachedir = os.path.join(self.root, "cache", "shard-{}".format(shard[0]))
+
+        # Development mode: reload templates when they change
+        self.develop = develop
+
+        # Markdown and Jinja2 compilers, created the first time a page is
+        # rendered, so that markdown, pygments and jinja2 are only loaded if
+        # needed
+        self._markdown = None
+        self._jinja2 = None
+        self._page_template = None
 
         self.count_render = 0
 
-    def write(self, site):
-        outdir = os.path.join(self.root, "web")
-        # Clear the target directory
-        if os.path.exists(outdir):
-            shutil.rmtree(outdir)
+    @property
+    def markdown(self):
+        if self._markdown is None:
+            from markdown import Markdown
+            self._markdown = Markdown(
+                extensions=["markdown.extensions.extra", "markdown.extensions.codehilite"],
+                output_format="html5"
+            )
+        return self._markdown
+
+    @property
+    def jinja2(self):
+        if self._jinja2 is None:
+            from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+            # Keep compiled templates across runs
+            bytecode_dir = os.path.join(self.cachedir, "jinja2")
+            os.makedirs(bytecode_dir, exist_ok=True)
+            self._jinja2 = Environment(
+                loader=FileSystemLoader(os.path.join(self.root, "templates")),
+                bytecode_cache=FileSystemBytecodeCache(bytecode_dir),
+                auto_reload=self.develop,
+            )
+            try:
+                from jinja2 import pass_context
+            except ImportError:
+                from jinja2 import contextfunction as pass_context
+            self._jinja2.globals["asset"] = pass_context(lambda context, path: self.asset(context, path))
+        return self._jinja2
+
+    @property
+    def page_template(self):
+        if self._page_template is None:
+            self._page_template = self.jinja2.get_template("__page__.html")
+        return self._page_template
+
+    def open_output(self, outdir):
+        self.outdir = outdir
+        if self.archive is not None and self.shard is None:
+            self.output = self.archive
+        else:
+            self.output = DirOutput(outdir, self.threads)
+        self.written = set()
+        self.shard_files = {}
+
+    def add_output(self, relpath):
+        if relpath in self.shard_files:
+            raise shards.ShardError("{} is generated by both shard {} and the merge".format(
+                relpath, self.shard_files[relpath]))
+        self.written.add(relpath)
+
+    def write_text(self, relpath, text):
+        self.add_output(relpath)
+        self.output.write_text(relpath, text)
+
+    def copy_file(self, relpath, src):
+        self.add_output(relpath)
+        self.output.copy_file(relpath, src)
+
+    def remove_stale(self):
+        # Remove files that were not generated by this run
+        for root, dirs, files in os.walk(self.outdir, topdown=False):
+            for f in files:
+                relpath = os.path.relpath(os.path.join(root, f), self.outdir)
+                if relpath in self.written or relpath == MANIFEST_NAME:
+                    continue
+                # Keep precompressed versions of files we still generate
+                if self.precompress and compress.is_sibling(relpath) and relpath[:-3] in self.written:
+                    continue
+                os.unlink(os.path.join(root, f))
+            if root != self.outdir and not os.listdir(root):
+                os.rmdir(root)
+
+    def load_cache(self, name):
+        try:
+            with open(os.path.join(self.cachedir, name), "rt") as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return {}
+
+    def save_cache(self, name, data):
+        os.makedirs(self.cachedir, exist_ok=True)
+        with open(os.path.join(self.cachedir, name), "wt") as out:
+            json.dump(data, out)
 
-        # Copy static content
+    def page_url(self, page):
+        if page.TYPE == "markdown":
+            return page.relpath_without_extension + ".html"
+        else:
+            return page.relpath
+
+    def shard_outdir(self, index):
+        return os.path.join(self.root, "web.shard-{}".format(index))
+
+    def in_shard(self, page):
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return shards.shard_of(page.relpath, count, self.shard_by) == index
+
+    def copy_static_dir(self):
         staticroot = os.path.join(self.root, "static")
         if os.path.isdir(staticroot):
-            shutil.copytree(staticroot, outdir)
+            for root, dirs, files in os.walk(staticroot):
+                for f in files:
+                    src = os.path.join(root, f)
+                    self.copy_file(os.path.relpath(src, staticroot), src)
+
+        # Add the fingerprinted copies, that can be cached forever
+        if self.assets is not None:
+            for relpath in self.assets.files:
+                self.copy_file(self.assets.fingerprinted(relpath), os.path.join(staticroot, relpath))
+            self.write_text("_headers", self.assets.headers())
+
+    def load_assets(self):
+        # Hash the static files, if fingerprinting is enabled
+        if not self.fingerprint:
+            return
+        self.assets = Assets(os.path.join(self.root, "static"), self.load_cache("assets.json"))
+        self.assets.scan()
+        self.save_cache("assets.json", self.assets.files)
+        log.info("Assets: %d static files, %d hashed", len(self.assets.files), self.assets.count_hashed)
+
+    def asset(self, context, path):
+        # Template function returning the URL of a file from the static
+        # directory, relative to the page being rendered. With fingerprinting,
+        # it is the URL of the fingerprinted copy
+        path = path.lstrip("/")
+        if self.assets is not None:
+            path = self.assets.fingerprinted(path)
+        relpath = context.get("relpath")
+        if relpath is None:
+            return "/" + path
+        return os.path.relpath(path, os.path.dirname(relpath) or ".")
+
+    def write(self, site):
+        if self.merge is not None:
+            self.write_merge(site)
+            return
+
+        if self.shard is None:
+            self.open_output(os.path.join(self.root, "web"))
+        else:
+            self.open_output(self.shard_outdir(self.shard[0]))
+        self.load_assets()
+
+        # Copy static content. When sharding, it is copied by the merge
+        if self.shard is None:
+            self.copy_static_dir()
+
+        pages = [p for p in site.pages.values() if self.in_shard(p)]
 
         # Remove leading spaces from markdown content
-        for page in site.pages.values():
+        for page in pages:
             if page.TYPE != "markdown": continue
             while page.body and page.body[0].is_blank:
                 page.body.pop(0)
 
+        # Select the pages that go in feeds, and keep their rendered HTML
+        self.select_feed_pages(site)
+        self.rendered = {}
+
+        self.search = SearchIndex(self.load_cache("search.json"))
+
+        # Related pages are computed on all the site, also when sharding
+        if self.related:
+            self.build_related(site)
+
+        # Pages rendered by this shard, for its partial manifest
+        self.shard_pages = {}
+
+        # Collect images from all the site, so that the HTML of each page is
+        # the same as in a full build. When sharding, only the images of this
+        # shard are resized and copied to its output: for the others, their
+        # size is enough to link their resized versions
+        if self.resize_images:
+            self.images = ImageDerivatives(self.cachedir, webp=self.webp)
+            images = self.collect_images(site)
+            if self.shard is None:
+                only = None
+            else:
+                only = set(relpath for relpath in images if self.in_shard(site.pages[relpath]))
+            self.images.build(images, only=only)
+        else:
+            self.images = None
+
+        self.highlight = HighlightCache(self.markdown, self.load_cache("highlight.json"))
+
         # Generate output
-        for page in site.pages.values():
-            getattr(self, "write_" + page.TYPE)(page)
-
-        # Generate tag indices
-        tags = set()
-        tags.update(*(x.tags for x in site.pages.values()))
-        for tag in tags:
-            dst = os.path.join(self.root, "web", "tags", tag + ".mdwn")
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            with open(dst, "wt") as out:
-                desc = site.tag_descriptions.get(tag, None)
-                if desc is None:
-                    desc = [tag.capitalize() + "."]
-                for line in desc:
-                    print(line, file=out)
-                print(file=out)
-                print('[[!inline pages="link(tags/{tag})" show="10"]]'.format(tag=tag), file=out)
-
-        # Generate index of tags
-        dst = os.path.join(self.root, "web", "tags/index.mdwn")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        with open(dst, "wt") as out:
-            print('[[!pagestats pages="tags/*"]]', file=out)
-            print('[[!inline pages="tags/*"]]', file=out)
+        write = type_dispatch(self, "write_")
+        for page in pages:
+            write[page.TYPE](page)
+
+        self.save_cache("highlight.json", self.highlight.blocks)
+        log.info("Code blocks: %d highlighted from cache, %d highlighted with Pygments",
+                 self.highlight.count_hit, self.highlight.count_miss)
+
+        if self.shard is None:
+            by_year = {}
+            for year in set(year for year, month in site.index.by_month):
+                year_pages = [p for p in site.index.in_year(year) if p.TYPE == "markdown"]
+                if year_pages:
+                    by_year[year] = year_pages
+            self.write_indices(site, site.tag_index, by_year)
+        else:
+            index, count = self.shard
+            # The manifest is only written once all the files are
+            self.output.flush()
+            shards.write_manifest(self.root, index, count, self.shard_pages, self.written, site.diagnostics)
+            self.save_cache("search.json", self.search.terms)
+            log.info("Shard %d/%d: %d of %d pages", index, count, len(pages), len(site.pages))
+
+        self.finish()
+
+    def write_merge(self, site):
+        # Combine the output of all shards, and generate the global indices
+        # from their partial manifests
+        self.open_output(os.path.join(self.root, "web"))
+        self.load_assets()
+
+        pages, files = shards.load_manifests(self.root, self.merge, site.diagnostics)
+
+        self.copy_static_dir()
+        for relpath, index in sorted(files.items()):
+            self.copy_file(relpath, os.path.join(self.shard_outdir(index), relpath))
+        # From now on, writing a file that a shard generated is a conflict
+        self.shard_files = files
+
+        # Check links across shards
+        for page in pages:
+            for url in page.links:
+                if url not in files and url not in self.written:
+                    site.diagnostics.add("unbuilt-link", page.relpath, None, url)
+
+        self.site_feed = heapq.nsmallest(self.FEED_SIZE, (p for p in pages if p.date is not None), key=date_key)
+        self.rendered = {p.relpath: p.html for p in pages if p.html is not None}
+
+        self.search = SearchIndex({})
+        for page in pages:
+            if page.terms is None: continue
+            self.search.add_terms(page.relpath, page.url, page.title or page.relpath_without_extension, page.terms)
+
+        tag_index = {}
+        by_year = {}
+        for page in sorted((p for p in pages if p.date is not None), key=date_key):
+            for tag in page.tags:
+                tag_index.setdefault(tag, []).append(page)
+            by_year.setdefault(page.date.year, []).append(page)
+
+        self.write_indices(site, tag_index, by_year)
+        self.finish()
+        log.warn("Merged %d shards", self.merge)
+
+    def write_indices(self, site, tag_index, by_year):
+        self.write_feeds(os.path.basename(site.root), tag_index)
+        if self.search_index:
+            self.write_search_index()
+        self.save_cache("search.json", self.search.terms)
+        if self.redirects is not None:
+            self.write_redirects(site)
+
+        # Generate tag pages, archives and the tag cloud, only rendering those
+        # whose contents changed since the last run
+        self.index_signatures = self.load_cache("indices.json")
+        self.index_signatures_new = {}
+        self.write_tag_pages(tag_index, site.tag_descriptions)
+        self.write_archives(by_year)
+        self.write_tag_cloud(tag_index)
+        self.save_cache("indices.json", self.index_signatures_new)
+
+    def finish(self):
+        self.output.close()
+        if self.output is not self.archive:
+            self.remove_stale()
+
+            if self.precompress:
+                compress.precompress(self.outdir)
+
+            write_manifest(self.outdir, known=self.output.hashes)
 
         log.warn("Rendered %d markdown pages", self.count_render)
 
+    def collect_images(self, site):
+        # Find the images shown in pages that can be resized
+        res = {}
+        for page in site.pages.values():
+            if page.TYPE != "markdown": continue
+            for el in page.body:
+                if not isinstance(el, content.InlineImage): continue
+                if el.target is None or el.target.TYPE != "static": continue
+                if os.path.splitext(el.target.relpath)[1].lower() not in RESIZABLE: continue
+                res[el.target.relpath] = el.target.abspath
+        return res
+
     def write_static(self, page):
-        dst = os.path.join(self.root, "web", page.relpath)
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        shutil.copy2(os.path.join(page.site.root, page.orig_relpath), dst)
+        self.copy_file(page.relpath, os.path.join(page.site.root, page.orig_relpath))
+        if self.images is not None and page.relpath in self.images.variants:
+            for relpath, src in self.images.outputs(page.relpath):
+                self.copy_file(relpath, src)
 
     def write_markdown(self, page):
-        writer = Webpage()
+        writer = Webpage(self.images, self.highlight)
         writer.read(page)
-        if writer.is_empty():
+        # Pages with no content are still listed in the indices, so they get
+        # a stub with only their title, which is left out of feeds and search
+        empty = writer.is_empty()
+
+        text = []
+        if page.title is not None:
+            text.append("# {title}\n".format(title=page.title))
+        text += writer.chunks
+        self.markdown.reset()
+        html = self.markdown.convert("".join(text))
+        self.count_render += 1
+        if page.relpath in self.feed_pages and not empty:
+            self.rendered[page.relpath] = html
+        url = self.page_url(page)
+        self.write_text(url, self.page_template.render(
+            content=html,
+            title=page.title,
+            tags=sorted(page.tags),
+            relpath=url,
+            related=self.related_links(page, url),
+        ))
+        if empty:
+            if self.shard is not None:
+                self.shard_pages[page.relpath] = self.shard_page_info(page)
+            return
+        # Shards always record terms, for the merge to index them
+        if self.search_index or self.shard is not None:
+            self.search.add(page, url)
+        if self.shard is not None:
+            info = self.shard_page_info(page)
+            info["links"] = sorted(set(
+                self.page_url(el.target) for el in page.body
+                if isinstance(el, (content.InternalLink, content.InlineImage)) and el.target is not None))
+            info["html"] = self.rendered.get(page.relpath)
+            info["terms"] = self.search.terms[page.relpath][2]
+            self.shard_pages[page.relpath] = info
+
+    def shard_page_info(self, page):
+        # What the merge needs to know about a page to index it. links, html
+        # and terms are only set for pages with content
+        return {
+            "url": self.page_url(page),
+            "title": page.title,
+            "tags": sorted(page.tags),
+            "date": page.date.isoformat() if page.date is not None else None,
+            "links": [],
+            "html": None,
+            "terms": None,
+        }
+
+    def build_related(self, site):
+        docs = {}
+        for page in site.pages.values():
+            if page.TYPE != "markdown": continue
+            # Skip pages with no content
+            if all(el.is_blank for el in page.body): continue
+            docs[page.relpath] = (sorted(page.tags), self.search.page_terms(page))
+        self.related_pages = RelatedPages(self.load_cache("related.json"), self.RELATED_SIZE)
+        self.related_pages.build(docs)
+        self.save_cache("related.json", self.related_pages.to_cache())
+        log.info("Related pages: %d of %d pages computed", self.related_pages.count_computed, len(docs))
+
+    def related_links(self, page, url):
+        # Related pages as a list of {"url", "title"}, with urls relative to
+        # the page at url
+        if self.related_pages is None:
+            return []
+        res = []
+        for relpath in self.related_pages.neighbours(page.relpath):
+            other = page.site.pages[relpath]
+            res.append({
+                "url": os.path.relpath(self.page_url(other), os.path.dirname(url) or "."),
+                "title": other.title or other.relpath_without_extension,
+            })
+        return res
+
+    def select_feed_pages(self, site):
+        # Use a bounded heap instead of sorting all the site
+        self.site_feed = heapq.nsmallest(
+                self.FEED_SIZE, (p for p in site.pages.values() if p.TYPE == "markdown"),
+                key=date_key)
+        self.feed_pages = set(p.relpath for p in self.site_feed)
+        # tag_index is already sorted
+        for pages in site.tag_index.values():
+            self.feed_pages.update(p.relpath for p in pages[:self.FEED_SIZE])
+
+    def feed_entries(self, pages):
+        return [(p, self.page_url(p), self.rendered[p.relpath]) for p in pages if p.relpath in self.rendered]
+
+    def write_feeds(self, title, tag_index):
+        if not self.site_url:
+            log.warn("Not writing Atom feeds, since they need --site-url")
+            return
+        feeds = AtomFeeds(self.site_url, self.site_author or title)
+        # A feed with no entries, because its pages have no content, is dated
+        # with its newest page
+        if self.site_feed:
+            updated = self.site_feed[0].date
+        else:
+            updated = datetime.datetime.now(datetime.timezone.utc)
+        self.write_text("index.atom", feeds.render(title, "index.atom", self.feed_entries(self.site_feed), updated))
+        for tag, pages in sorted(tag_index.items()):
+            relpath = os.path.join("tags", tag + ".atom")
+            self.write_text(relpath, feeds.render(
+                tag, relpath, self.feed_entries(pages[:self.FEED_SIZE]), pages[0].date))
+        log.info("Feeds: %d entries", len(feeds.entries))
+
+    def alias_url(self, relpath, page):
+        if page.TYPE == "markdown":
+            return "/" + os.path.splitext(relpath)[0] + ".html"
+        else:
+            return "/" + relpath
+
+    def write_redirects(self, site):
+        # Write a single redirect map for all aliases. The _redirects file is
+        # read by the hosting service from the web root, while server
+        # configuration goes next to it
+        text = redirects.render(redirects.redirect_map(site, self.alias_url), self.redirects)
+        name = redirects.FORMATS[self.redirects]
+        if self.redirects == "netlify":
+            self.write_text(name, text)
+        else:
+            with open(os.path.join(self.root, name), "wt") as out:
+                out.write(text)
+
+    def write_search_index(self):
+        size = 0
+        files = self.search.build()
+        for name, data in files.items():
+            text = self.search.encode(data)
+            size += len(text.encode())
+            self.write_text(os.path.join("search", name), text)
+        self.write_text(os.path.join("search", "search.js"), LOADER_JS)
+        log.info("Search index: %d documents (%d tokenized), %d bytes in %d files, built in %.3fs",
+                 len(self.search.docs), self.search.count_tokenized, size, len(files), self.search.elapsed)
+
+    def write_index_page(self, relpath, title, render, *signature):
+        # Write a generated index page. render is a function returning the
+        # HTML contents of the page, and it is only called if signature, which
+        # describes all that goes into the page, changed since the last run
+        assets = self.assets.signature if self.assets is not None else None
+        signature = json.dumps([title, self.template_mtime, assets] + list(signature))
+        self.index_signatures_new[relpath] = signature
+        if self.index_signatures.get(relpath) == signature and self.output.exists(relpath):
+            self.add_output(relpath)
+            return
+        self.write_text(relpath, self.page_template.render(
+            content=render(),
+            title=title,
+            tags=[],
+            relpath=relpath,
+        ))
+
+    @property
+    def template_mtime(self):
+        return os.path.getmtime(os.path.join(self.root, "templates", "__page__.html"))
+
+    def render_page_list(self, relpath, pages):
+        res = ['<ul class="pagelist">']
+        reldir = os.path.dirname(relpath)
+        for page in pages:
+            res.append('<li><a href="{url}">{title}</a> <time datetime="{date}">{date}</time></li>'.format(
+                url=href(os.path.relpath(self.page_url(page), reldir)),
+                title=html.escape(page.title or page.relpath_without_extension),
+                date=page.date.strftime("%Y-%m-%d")))
+        res.append("</ul>")
+        return res
+
+    def page_list_signature(self, pages):
+        return [(p.relpath, p.title, p.date.isoformat()) for p in pages]
+
+    def tag_page_relpath(self, tag, pageno):
+        # All the pages of a tag are in its own directory, so that no tag name
+        # can clash with the tag cloud in tags/index.html
+        if pageno == 1:
+            return os.path.join("tags", tag, "index.html")
+        else:
+            return os.path.join("tags", tag, "{}.html".format(pageno))
+
+    def write_tag_pages(self, tag_index, tag_descriptions):
+        for tag, pages in sorted(tag_index.items()):
+            desc = tag_descriptions.get(tag, None)
+            if desc is None:
+                desc = [tag.capitalize() + "."]
+            pagecount = (len(pages) + self.TAG_PAGE_SIZE - 1) // self.TAG_PAGE_SIZE
+            for pageno in range(1, pagecount + 1):
+                chunk = pages[(pageno - 1) * self.TAG_PAGE_SIZE:pageno * self.TAG_PAGE_SIZE]
+                relpath = self.tag_page_relpath(tag, pageno)
+
+                def render():
+                    self.markdown.reset()
+                    res = [self.markdown.convert("\n".join(desc))]
+                    res.extend(self.render_page_list(relpath, chunk))
+                    nav = []
+                    reldir = os.path.dirname(relpath)
+                    if pageno > 1:
+                        nav.append('<a rel="prev" href="{}">Newer posts</a>'.format(
+                            href(os.path.relpath(self.tag_page_relpath(tag, pageno - 1), reldir))))
+                    if pageno < pagecount:
+                        nav.append('<a rel="next" href="{}">Older posts</a>'.format(
+                            href(os.path.relpath(self.tag_page_relpath(tag, pageno + 1), reldir))))
+                    if nav:
+                        res.append('<nav class="pagination">{}</nav>'.format(" ".join(nav)))
+                    return "\n".join(res)
+
+                self.write_index_page(relpath, tag, render,
+                                      desc, pageno, pagecount, self.page_list_signature(chunk))
+
+    def write_archives(self, by_year):
+        for year, pages in sorted(by_year.items()):
+            relpath = os.path.join("archive", "{}.html".format(year))
+            self.write_index_page(relpath, str(year),
+                                  lambda: "\n".join(self.render_page_list(relpath, pages)),
+                                  self.page_list_signature(pages))
+
+        years = sorted(((year, len(pages)) for year, pages in by_year.items()), reverse=True)
+
+        def render():
+            res = ['<ul class="archive">']
+            for year, count in years:
+                res.append('<li><a href="{year}.html">{year}</a> ({count})</li>'.format(year=year, count=count))
+            res.append("</ul>")
+            return "\n".join(res)
+
+        self.write_index_page(os.path.join("archive", "index.html"), "Archive", render, years)
+
+    def write_tag_cloud(self, tag_index):
+        counts = sorted((tag, len(pages)) for tag, pages in tag_index.items())
+        if not counts:
             return
+        max_count = max(count for tag, count in counts)
 
-        dst = os.path.join(self.root, "web", page.relpath_without_extension + ".html")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-
-        with open(dst, "wt") as out:
-            text = []
-            if page.title is not None:
-                text.append("# {title}\n".format(title=page.title))
-            text += writer.chunks
-            self.markdown.reset()
-            html = self.markdown.convert("".join(text))
-            self.count_render += 1
-            out.write(self.page_template.render(
-                content=html,
-                title=page.title,
-                tags=sorted(page.tags),
-            ))
-
-#        for relpath in page.aliases:
-#            dst = os.path.join(self.root, relpath)
-#            os.makedirs(os.path.dirname(dst), exist_ok=True)
-#            with open(dst, "wt") as out:
-#                print('[[!meta redir="{relpath}"]]'.format(relpath=page.relpath_without_extension), file=out)
+        def render():
+            res = ['<ul class="tagcloud">']
+            for tag, count in counts:
+                # Size tags in 5 steps, according to their usage
+                size = 1 + (count * 4) // max_count
+                res.append('<li class="tag-size-{size}"><a href="{url}">{tag}</a> ({count})</li>'.format(
+                    size=size, url=href(os.path.relpath(self.tag_page_relpath(tag, 1), "tags")), tag=html.escape(tag),
+                    count=count))
+            res.append("</ul>")
+            return "\n".join(res)
 
+        self.write_index_page(os.path.join("tags", "index.html"), "Tags", render, counts)
@@ -0,0 +1,31 @@
+# coding: utf-8
+# Helpers shared by the tests. tests/ is in sys.path both with pytest and with
+# python -m unittest discover -s tests, so test modules import them with
+# "from conftest import ..."
+import os
+
+from siterefactorlib.manifest import MANIFEST_NAME
+
+
+def write(root, relpath, text):
+    # Write text to root/relpath, creating its directory
+    pathname = os.path.join(root, relpath)
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    with open(pathname, "wt") as out:
+        out.write(text)
+
+
+def read(root, relpath):
+    with open(os.path.join(root, relpath), "rt") as fd:
+        return fd.read()
+
+
+def tree(root):
+    # Return the relpaths of all the files in root, but the manifest
+    res = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            relpath = os.path.relpath(os.path.join(dirpath, name), root)
+            if relpath != MANIFEST_NAME:
+                res.append(relpath)
+    return sorted(res)
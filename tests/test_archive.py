@@ -0,0 +1,63 @@
+# coding: utf-8
+from unittest import mock
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+import zipfile
+from conftest import write
+from siterefactorlib.core import load_site
+from siterefactorlib.ikiwiki import IkiwikiWriter
+from siterefactorlib.output import archive_output
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        write(self.src, "tags/debian.mdwn", "Posts about Debian.\n")
+        for i in range(3):
+            write(self.src, "blog/2015/post{}.mdwn".format(i),
+                  '[[!meta date="2015-03-0{} 10:00"]]\n[[!tag tags/debian]]\n# Post {}\n\nText.\n'.format(i + 1, i))
+        write(self.src, "blog/2015/file.txt", "A static file\n")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def build(self, name, epoch):
+        pathname = os.path.join(self.workdir.name, name)
+        with mock.patch.dict(os.environ, {"SOURCE_DATE_EPOCH": str(epoch)}):
+            output = archive_output(pathname)
+            IkiwikiWriter(os.path.join(self.workdir.name, "unused"), output=output).write(load_site(self.src))
+        with open(pathname, "rb") as fd:
+            return fd.read()
+
+    def test_reproducible(self):
+        epoch = 1500000000
+        for name in ("site.tar", "site.tar.gz", "site.zip"):
+            with self.subTest(name=name):
+                first = self.build(name, epoch)
+                # Source mtimes do not end up in the archive
+                os.utime(os.path.join(self.src, "blog/2015/file.txt"), (time.time() + 100, time.time() + 100))
+                time.sleep(0.01)
+                self.assertEqual(self.build(name, epoch), first)
+                self.assertNotEqual(self.build(name, epoch + 3600), first)
+
+    def test_member_times(self):
+        epoch = 1500000000
+        self.build("site.tar.gz", epoch)
+        with tarfile.open(os.path.join(self.workdir.name, "site.tar.gz")) as tar:
+            members = tar.getmembers()
+        self.assertIn("blog/2015/file.txt", [m.name for m in members])
+        for m in members:
+            self.assertEqual(m.mtime, epoch, m.name)
+            self.assertEqual((m.uid, m.gid, m.uname, m.gname), (0, 0, "", ""), m.name)
+            self.assertEqual(m.mode, 0o755 if m.isdir() else 0o644, m.name)
+
+        self.build("site.zip", epoch)
+        with zipfile.ZipFile(os.path.join(self.workdir.name, "site.zip")) as zf:
+            infos = zf.infolist()
+        self.assertIn("blog/2015/file.txt", [i.filename for i in infos])
+        for info in infos:
+            self.assertEqual(info.date_time, time.gmtime(epoch)[:6], info.filename)
@@ -0,0 +1,104 @@
+# coding: utf-8
+import hashlib
+import os
+import tempfile
+import unittest
+from conftest import read, write
+from siterefactorlib.assets import IMMUTABLE, Assets
+from siterefactorlib.core import load_site
+
+
+def short_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.workdir.name, "static")
+        write(self.static, "css/site.css", "body { color: black }\n")
+        write(self.static, "logo", "not really a logo\n")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_names(self):
+        assets = Assets(self.static, {})
+        assets.scan()
+        self.assertEqual(assets.count_hashed, 2)
+        self.assertEqual(assets.fingerprinted("css/site.css"),
+                         "css/site.{}.css".format(short_hash("body { color: black }\n")))
+        self.assertEqual(assets.fingerprinted("logo"), "logo.{}".format(short_hash("not really a logo\n")))
+        # Files not in the static directory keep their name
+        self.assertEqual(assets.fingerprinted("css/other.css"), "css/other.css")
+
+    def test_headers(self):
+        assets = Assets(self.static, {})
+        assets.scan()
+        self.assertEqual(assets.headers(), "".join("/{}\n  Cache-Control: {}\n".format(
+            assets.fingerprinted(relpath), IMMUTABLE) for relpath in ("css/site.css", "logo")))
+
+    def test_cache(self):
+        assets = Assets(self.static, {})
+        assets.scan()
+
+        # Unchanged files are not hashed again
+        cached = Assets(self.static, assets.files)
+        cached.scan()
+        self.assertEqual(cached.count_hashed, 0)
+        self.assertEqual(cached.files, assets.files)
+        self.assertEqual(cached.signature, assets.signature)
+
+        # Changed files get a new name, and a new signature
+        write(self.static, "css/site.css", "body { color: white }\n")
+        changed = Assets(self.static, assets.files)
+        changed.scan()
+        self.assertEqual(changed.count_hashed, 1)
+        self.assertEqual(changed.fingerprinted("css/site.css"),
+                         "css/site.{}.css".format(short_hash("body { color: white }\n")))
+        self.assertEqual(changed.fingerprinted("logo"), assets.fingerprinted("logo"))
+        self.assertNotEqual(changed.signature, assets.signature)
+
+
+class TestWebAssets(unittest.TestCase):
+    def setUp(self):
+        try:
+            from siterefactorlib.web import WebWriter
+        except ImportError as e:
+            self.skipTest("web output not available: {}".format(e))
+        self.WebWriter = WebWriter
+
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(self.src, "tags"))
+        write(self.src, "blog/2015/post.mdwn", '[[!meta date="2015-03-01 10:00"]]\n# Post\n\nText.\n')
+
+        self.root = os.path.join(self.workdir.name, "dest")
+        write(self.root, "templates/__page__.html",
+              '<html><head><link rel="stylesheet" href="{{asset("css/site.css")}}"></head>'
+              '<body>{{content}}</body></html>\n')
+        write(self.root, "static/css/site.css", "body { color: black }\n")
+        self.web = os.path.join(self.root, "web")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def build(self):
+        self.WebWriter(self.root, site_url="https://example.org/", fingerprint=True).write(load_site(self.src))
+
+    def test_fingerprint(self):
+        self.build()
+        name = "css/site.{}.css".format(short_hash("body { color: black }\n"))
+        # Both the original and the fingerprinted copy are in the output
+        self.assertEqual(read(self.web, "css/site.css"), "body { color: black }\n")
+        self.assertEqual(read(self.web, name), "body { color: black }\n")
+        self.assertEqual(read(self.web, "_headers"), "/{}\n  Cache-Control: {}\n".format(name, IMMUTABLE))
+        # Pages link to the fingerprinted copy
+        self.assertIn('href="../../{}"'.format(name), read(self.web, "blog/2015/post.html"))
+
+        # Changing a static file renders the pages again with the new name
+        write(self.root, "static/css/site.css", "body { color: white }\n")
+        self.build()
+        name = "css/site.{}.css".format(short_hash("body { color: white }\n"))
+        self.assertIn('href="../../{}"'.format(name), read(self.web, "blog/2015/post.html"))
+        self.assertIn("/" + name + "\n", read(self.web, "_headers"))
@@ -0,0 +1,56 @@
+# coding: utf-8
+import os
+import tempfile
+import unittest
+from conftest import write
+from siterefactorlib.core import load_site
+
+
+def links(site):
+    # Return (source, target, link path) for all links and images of the site
+    res = []
+    for page in {p.relpath: p for p in site.pages.values()}.values():
+        for el in getattr(page, "body", ()):
+            target = getattr(el, "target", None)
+            if target is None:
+                continue
+            res.append((page.relpath, target.relpath, site.link_path(page.relpath, target.relpath)))
+    return sorted(res)
+
+
+class TestRelocate(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def make_site(self, name, year_dir):
+        # Pages link to each other in the same directory, and across the tree
+        root = os.path.join(self.workdir.name, name)
+        write(root, "tags/debian.mdwn", "Posts about Debian.\n")
+        write(root, os.path.join(year_dir, "a.mdwn"),
+              "# A\n\nSee [[b]], [[/blog/2016/c]] and [[!img pic.png alt=\"Picture\"]].\n")
+        write(root, os.path.join(year_dir, "b.mdwn"), "# B\n\nBack to [[a]].\n")
+        write(root, os.path.join(year_dir, "pic.png"), "not really a picture\n")
+        write(root, "blog/2016/c.mdwn", "# C\n\nSee [[2015/a]] and [[2015/b]].\n")
+        return load_site(root)
+
+    def test_link_paths_match_fresh_scan(self):
+        site = self.make_site("site", "2015")
+        # Fill the link path cache for the old locations
+        before = links(site)
+        self.assertIn(("2015/a.mdwn", "2015/b.mdwn", "b.mdwn"), before)
+        self.assertIn(("blog/2016/c.mdwn", "2015/a.mdwn", "../../2015/a.mdwn"), before)
+
+        for relpath, page in list(site.pages.items()):
+            if relpath.startswith("2015/"):
+                site.relocate(page, os.path.join("blog", relpath))
+
+        # Relocating does not throw away the cache
+        self.assertIn(("2015", "2015/b.mdwn"), site.link_paths)
+
+        fresh = self.make_site("fresh", "blog/2015")
+        self.assertEqual(links(site), links(fresh))
+        self.assertIn(("blog/2016/c.mdwn", "blog/2015/a.mdwn", "../2015/a.mdwn"), links(site))
+        self.assertIn(("blog/2015/a.mdwn", "blog/2015/pic.png", "pic.png"), links(site))
@@ -0,0 +1,84 @@
+# coding: utf-8
+from unittest import mock
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from conftest import write
+from siterefactorlib.daemon import SiteDaemon, Server, ServeError, remove_stale_socket
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(self.src, "tags"))
+        write(self.src, "blog/2015/post.mdwn",
+              '[[!meta date="2015-03-01 10:00"]]\n[[!tag tags/debian]]\n# Post\n\nSee [[other]].\n')
+        write(self.src, "blog/2015/other.mdwn", '[[!meta date="2015-03-02 10:00"]]\n# Other\n\nText.\n')
+        self.daemon = SiteDaemon(self.src)
+        self.path = os.path.join(self.workdir.name, "socket")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def start(self):
+        server = Server(self.path, self.daemon)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(10)
+        sock.connect(self.path)
+        self.addCleanup(sock.close)
+        return sock, sock.makefile("rb")
+
+    def query(self, conn, request):
+        sock, rfile = conn
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        return json.loads(rfile.readline())
+
+    def test_handle(self):
+        res = self.daemon.handle({"command": "resolve", "page": "blog/2015/post.mdwn", "target": "other"})
+        self.assertEqual(res, {"result": "blog/2015/other.mdwn"})
+
+        res = self.daemon.handle({"command": "resolve", "page": "blog/2015/post.mdwn"})
+        self.assertIn("invalid arguments for resolve", res["error"])
+
+        # Errors inside handlers are not mistaken for bad requests
+        with mock.patch.object(SiteDaemon, "do_resolve", side_effect=TypeError("bug")):
+            with self.assertLogs(level="ERROR"):
+                res = self.daemon.handle({"command": "resolve", "page": "p", "target": "t"})
+        self.assertEqual(res, {"error": "TypeError: bug"})
+
+    def test_concurrent_clients(self):
+        self.start()
+        first = self.connect()
+        self.assertEqual(self.query(first, {"command": "list-tag", "tag": "debian"})["result"][0]["relpath"],
+                         "blog/2015/post.mdwn")
+        # A second client is answered while the first one is still connected
+        second = self.connect()
+        self.assertEqual(self.query(second, {"command": "resolve", "page": "blog/2015/post.mdwn",
+                                             "target": "other"}), {"result": "blog/2015/other.mdwn"})
+
+    def test_socket_in_use(self):
+        self.start()
+        with self.assertRaises(ServeError):
+            remove_stale_socket(self.path)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        remove_stale_socket(self.path)
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,36 @@
+# coding: utf-8
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from conftest import write
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestFmt(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(self.src, "tags"))
+        write(self.src, "blog/2015/winter.mdwn", '[[!meta date="2015-01-10T10:00:00+01:00"]]\n# Winter\n\nText.\n')
+        write(self.src, "blog/2015/summer.mdwn", '[[!meta date="2015-07-10 10:00"]]\n# Summer\n\nText.\n')
+        write(self.src, "blog/2015/utc.mdwn", '[[!meta date="2015-03-29T01:30:00Z"]]\n# UTC\n\nText.\n')
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def fmt(self, tz, *args):
+        env = dict(os.environ, TZ=tz)
+        return subprocess.run([sys.executable, os.path.join(ROOT, "siterefactor"), "-t", "fmt", *args, self.src],
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_check_in_other_timezones(self):
+        # fmt output does not depend on the timezone of the machine
+        res = self.fmt("Europe/Rome")
+        self.assertEqual(res.returncode, 0, res.stderr)
+        for tz in ("Europe/Rome", "UTC", "America/New_York"):
+            with self.subTest(tz=tz):
+                res = self.fmt(tz, "--check")
+                self.assertEqual(res.returncode, 0, res.stderr)
@@ -0,0 +1,85 @@
+# coding: utf-8
+import os
+import tempfile
+import unittest
+from conftest import write
+from siterefactorlib.core import load_site
+
+PAGE = '''# Code
+
+Some *text* before the code.
+
+[[!format python """
+def hello(name):
+    # Say *hello*
+    print("<b>Hello</b>, {}".format(name))
+"""]]
+
+Text between blocks.
+
+[[!format sh """
+echo "hello" | tr a-z A-Z
+"""]]
+
+[[!format python """
+def hello(name):
+    # Say *hello*
+    print("<b>Hello</b>, {}".format(name))
+"""]]
+
+[[!format nosuchlanguage """
+plain text
+"""]]
+'''
+
+
+class TestHighlightCache(unittest.TestCase):
+    def setUp(self):
+        try:
+            import markdown  # noqa: F401
+            import pygments  # noqa: F401
+            from siterefactorlib.web import Webpage
+        except ImportError as e:
+            self.skipTest("highlighting needs markdown and pygments: {}".format(e))
+        self.Webpage = Webpage
+
+        self.workdir = tempfile.TemporaryDirectory()
+        src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(src, "tags"))
+        write(src, "blog/2015/code.mdwn", PAGE)
+        self.page = load_site(src).pages["blog/2015/code.mdwn"]
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def markdown(self):
+        # The same markdown setup as WebWriter
+        from markdown import Markdown
+        return Markdown(extensions=["markdown.extensions.extra", "markdown.extensions.codehilite"],
+                        output_format="html5")
+
+    def render(self, markdown, highlight=None):
+        writer = self.Webpage(highlight=highlight)
+        writer.read(self.page)
+        markdown.reset()
+        return markdown.convert("".join(writer.chunks))
+
+    def test_same_as_codehilite(self):
+        from siterefactorlib.highlight import HighlightCache
+        plain = self.render(self.markdown())
+        self.assertIn('class="codehilite"', plain)
+
+        md = self.markdown()
+        highlight = HighlightCache(md, {})
+        self.assertEqual(self.render(md, highlight), plain)
+        # The repeated block is only highlighted once
+        self.assertEqual(highlight.count_miss, 3)
+        self.assertEqual(highlight.count_hit, 1)
+
+        # Blocks from the cache of a previous build give the same output
+        md = self.markdown()
+        cached = HighlightCache(md, highlight.blocks)
+        self.assertEqual(self.render(md, cached), plain)
+        self.assertEqual(cached.count_miss, 0)
+        self.assertEqual(cached.count_hit, 4)
+        self.assertEqual(cached.blocks, highlight.blocks)
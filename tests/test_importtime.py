@@ -0,0 +1,50 @@
+# coding: utf-8
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when a code path needs them
+HEAVY = ("markdown", "jinja2", "pygments", "pytz", "dateutil", "PIL", "numpy", "scipy")
+
+# Maximum cumulative import time of each module, in microseconds. They are
+# generous, to be stable on slow machines, and catch heavy imports creeping
+# back in
+BUDGET = {
+    "siterefactorlib.core": 150000,
+    "siterefactorlib.web": 250000,
+}
+
+
+def import_times(module):
+    # Return a dict mapping the modules imported by "import module" to their
+    # cumulative import time, as reported by python -X importtime
+    proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + module],
+            cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    res = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            # Header line
+            continue
+        res[name.strip()] = int(cumulative)
+    return res
+
+
+class TestImportTime(unittest.TestCase):
+    def test_budget(self):
+        for module, budget in BUDGET.items():
+            with self.subTest(module=module):
+                times = import_times(module)
+                heavy = sorted(name for name in times if name.split(".")[0] in HEAVY)
+                self.assertEqual(heavy, [])
+                self.assertLess(times[module], budget)
+
+
+if __name__ == "__main__":
+    unittest.main()
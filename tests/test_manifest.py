@@ -0,0 +1,106 @@
+# coding: utf-8
+from unittest import mock
+import os
+import tempfile
+import unittest
+from conftest import write
+from siterefactorlib import manifest
+from siterefactorlib.manifest import Manifest, Deployer, MANIFEST_NAME, manifest_path, scan_manifest, write_manifest
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.workdir.name, "out")
+        write(self.root, "index.html", "index")
+        write(self.root, "blog/post.html", "post")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_roundtrip(self):
+        written = write_manifest(self.root)
+        # The manifest is inside the output directory, and does not list
+        # itself
+        self.assertTrue(os.path.exists(os.path.join(self.root, MANIFEST_NAME)))
+        self.assertEqual(sorted(written.files), ["blog/post.html", "index.html"])
+
+        loaded = Manifest.load(manifest_path(self.root))
+        self.assertEqual(loaded.files, written.files)
+        self.assertEqual(loaded.digest, written.digest)
+
+        # Unchanged files are not hashed again
+        with mock.patch.object(manifest, "file_hash") as file_hash:
+            rescanned = scan_manifest(self.root)
+        file_hash.assert_not_called()
+        self.assertEqual(rescanned.files, written.files)
+
+    def test_relpaths(self):
+        write(self.root, ".git/config", "not generated")
+        written = write_manifest(self.root, ["index.html"])
+        self.assertEqual(sorted(written.files), ["index.html"])
+
+    def test_diff(self):
+        old = write_manifest(self.root)
+        write(self.root, "index.html", "changed index")
+        write(self.root, "new.html", "new")
+        os.unlink(os.path.join(self.root, "blog/post.html"))
+        new = scan_manifest(self.root)
+        self.assertEqual(new.diff(old), (["new.html"], ["index.html"], ["blog/post.html"]))
+
+
+class TestDeploy(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "web")
+        self.target = os.path.join(self.workdir.name, "target")
+        write(self.src, "index.html", "index")
+        write(self.src, "blog/post.html", "post")
+        write(self.src, "style.css", "css")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def read_live(self, relpath):
+        with open(os.path.join(self.target, "current", relpath), "rt") as fd:
+            return fd.read()
+
+    def test_deploy(self):
+        deployer = Deployer(self.target)
+        added, changed, removed = deployer.deploy(self.src, write_manifest(self.src))
+        self.assertEqual(added, ["blog/post.html", "index.html", "style.css"])
+        self.assertEqual((changed, removed), ([], []))
+        self.assertEqual(self.read_live("index.html"), "index")
+        self.assertFalse(os.path.exists(os.path.join(self.target, "current", MANIFEST_NAME)))
+        first = os.readlink(os.path.join(self.target, "current"))
+
+        write(self.src, "index.html", "new index")
+        write(self.src, "about.html", "about")
+        os.unlink(os.path.join(self.src, "style.css"))
+        manifest = scan_manifest(self.src)
+
+        # A dry run does not touch the target
+        self.assertEqual(deployer.deploy(self.src, manifest, dry_run=True),
+                         (["about.html"], ["index.html"], ["style.css"]))
+        self.assertEqual(os.readlink(os.path.join(self.target, "current")), first)
+
+        self.assertEqual(deployer.deploy(self.src, manifest),
+                         (["about.html"], ["index.html"], ["style.css"]))
+        second = os.readlink(os.path.join(self.target, "current"))
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.read_live("index.html"), "new index")
+        self.assertEqual(self.read_live("about.html"), "about")
+        self.assertFalse(os.path.exists(os.path.join(self.target, "current", "style.css")))
+
+        # Unchanged files are shared with the previous release
+        old_post = os.stat(os.path.join(self.target, first, "blog/post.html"))
+        new_post = os.stat(os.path.join(self.target, second, "blog/post.html"))
+        self.assertEqual(old_post.st_ino, new_post.st_ino)
+
+        # Deploying the same tree again changes nothing
+        self.assertEqual(deployer.deploy(self.src, manifest), ([], [], []))
+        self.assertEqual(os.readlink(os.path.join(self.target, "current")), second)
+
+
+if __name__ == "__main__":
+    unittest.main()
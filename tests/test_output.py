@@ -0,0 +1,120 @@
+# coding: utf-8
+from unittest import mock
+import builtins
+import os
+import tempfile
+import threading
+import unittest
+from conftest import read, write
+from siterefactorlib.manifest import write_manifest
+from siterefactorlib.output import DirOutput, QUEUE_PER_THREAD
+
+
+class TestDirOutput(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.workdir.name, "out")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def build(self, files, threads=0):
+        output = DirOutput(self.root, threads)
+        for relpath, text in files.items():
+            output.write_text(relpath, text)
+        output.close()
+        write_manifest(self.root, output.written, output.hashes)
+        return output
+
+    def test_unchanged_files_are_not_read(self):
+        self.build({"a.html": "a", "b/c.html": "c"})
+        mtime = os.stat(os.path.join(self.root, "a.html")).st_mtime_ns
+
+        # Existing files are compared with the manifest, and never opened
+        real_open = builtins.open
+
+        def no_read(file, mode="r", *args, **kw):
+            if "r" in mode and str(file).startswith(self.root) and not str(file).endswith(".json"):
+                raise AssertionError("{} read back".format(file))
+            return real_open(file, mode, *args, **kw)
+
+        with mock.patch("builtins.open", no_read):
+            self.build({"a.html": "a", "b/c.html": "changed"})
+        self.assertEqual(os.stat(os.path.join(self.root, "a.html")).st_mtime_ns, mtime)
+        self.assertEqual(read(self.root, "b/c.html"), "changed")
+
+    def test_changed_on_disk(self):
+        self.build({"a.html": "a"})
+        # A file changed by someone else is written again, even if it is not
+        # valid UTF-8
+        with open(os.path.join(self.root, "a.html"), "wb") as out:
+            out.write(b"\xff\xfe\x00")
+        self.build({"a.html": "a"})
+        self.assertEqual(read(self.root, "a.html"), "a")
+
+    def test_no_manifest(self):
+        write(self.root, "a.html", "\xff")
+        self.build({"a.html": "a"})
+        self.assertEqual(read(self.root, "a.html"), "a")
+
+    def test_backpressure(self):
+        output = DirOutput(self.root, threads=1)
+        release = threading.Event()
+        done = []
+
+        def slow(relpath):
+            release.wait(10)
+            done.append(relpath)
+
+        submitted = []
+
+        def submit():
+            for i in range(QUEUE_PER_THREAD + 1):
+                output.submit(slow, "file{}".format(i))
+                submitted.append(i)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # The writer stops when the queue is full, until the oldest write is
+        # done
+        thread.join(0.5)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(len(submitted), QUEUE_PER_THREAD)
+        release.set()
+        thread.join(10)
+        self.assertEqual(len(submitted), QUEUE_PER_THREAD + 1)
+        output.close()
+        self.assertEqual(len(done), QUEUE_PER_THREAD + 1)
+
+    def test_flush(self):
+        output = DirOutput(self.root, threads=4)
+        for i in range(50):
+            output.write_text("file{}.html".format(i), str(i))
+        # flush returns once all the files are written
+        output.flush()
+        for i in range(50):
+            self.assertEqual(read(self.root, "file{}.html".format(i)), str(i))
+        output.close()
+
+    def test_error_order(self):
+        output = DirOutput(self.root, threads=2)
+        started = threading.Event()
+
+        def fail_late(relpath):
+            started.wait(10)
+            raise ValueError(relpath)
+
+        def fail_early(relpath):
+            try:
+                raise KeyError(relpath)
+            finally:
+                started.set()
+
+        output.submit(fail_late, "first")
+        output.submit(fail_early, "second")
+        # The error of the write queued first is raised, even if the other
+        # one failed earlier
+        with self.assertRaises(ValueError) as e:
+            output.flush()
+        self.assertEqual(str(e.exception), "first")
+        output.close()
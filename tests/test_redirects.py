@@ -0,0 +1,69 @@
+# coding: utf-8
+import os
+import tempfile
+import unittest
+from conftest import read, write
+from siterefactorlib import redirects
+from siterefactorlib.core import load_site
+from siterefactorlib.ssite import SSiteWriter
+
+
+class TestRedirects(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        write(self.src, "tags/debian.mdwn", "Posts about Debian.\n")
+        write(self.src, "blog/2015/real.mdwn", "# Real\n\nThe page.\n")
+        # A chain of aliases: older -> old -> real
+        write(self.src, "blog/2015/old.mdwn", '[[!meta redir="real"]]\n')
+        write(self.src, "blog/2015/older.mdwn", '[[!meta redir="old"]]\n')
+        # A loop, and an alias to a missing page
+        write(self.src, "blog/2015/loop1.mdwn", '[[!meta redir="loop2"]]\n')
+        write(self.src, "blog/2015/loop2.mdwn", '[[!meta redir="loop1"]]\n')
+        write(self.src, "blog/2015/broken.mdwn", '[[!meta redir="missing"]]\n')
+        self.site = load_site(self.src)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_chains_collapse(self):
+        page = self.site.pages["blog/2015/real.mdwn"]
+        self.assertEqual(sorted(page.aliases), ["blog/2015/old.mdwn", "blog/2015/older.mdwn"])
+
+        # Aliases that do not lead to a page are reported, and not followed
+        # forever
+        missing = sorted(e[1] for e in self.site.diagnostics.entries if e[0] == "missing-redirect")
+        self.assertEqual(missing, ["blog/2015/broken.mdwn", "blog/2015/loop1.mdwn", "blog/2015/loop2.mdwn"])
+
+        # Each old URL leads to the final one in one step
+        res = redirects.redirect_map(self.site, SSiteWriter(self.workdir.name).alias_url)
+        self.assertEqual(res, [
+            ("/blog/2015/old/", "/blog/2015/real/"),
+            ("/blog/2015/older/", "/blog/2015/real/"),
+        ])
+        sources = set(src for src, dest in res)
+        for src, dest in res:
+            self.assertNotIn(dest, sources)
+
+    def test_render(self):
+        res = [("/a b/", "/c d/"), ('/q"uote/', "/dest/")]
+        self.assertEqual(redirects.render(res, "nginx"),
+                         'map $uri $redirect_uri {\n    "/a b/" "/c%20d/";\n    "/q\\"uote/" "/dest/";\n}\n')
+        self.assertEqual(redirects.render(res, "apache"), "/a%20b/ /c%20d/\n/q%22uote/ /dest/\n")
+        self.assertEqual(redirects.render(res, "netlify"), "/a%20b/ /c%20d/ 301\n/q%22uote/ /dest/ 301\n")
+        with self.assertRaises(ValueError):
+            redirects.render(res, "lighttpd")
+
+    def test_ssite(self):
+        # A _redirects file goes in the site, server configuration outside it
+        dest = os.path.join(self.workdir.name, "ssite")
+        SSiteWriter(dest, redirects="netlify").write(self.site)
+        self.assertEqual(read(dest, "site/_redirects"),
+                         "/blog/2015/old/ /blog/2015/real/ 301\n/blog/2015/older/ /blog/2015/real/ 301\n")
+
+        dest = os.path.join(self.workdir.name, "ssite-nginx")
+        SSiteWriter(dest, redirects="nginx").write(self.site)
+        self.assertTrue(os.path.exists(os.path.join(dest, "redirects.nginx.map")))
+        self.assertFalse(os.path.exists(os.path.join(dest, "site", "redirects.nginx.map")))
+        # No stub files are written for aliases
+        self.assertFalse(os.path.exists(os.path.join(dest, "site", "blog", "2015", "old.mdwn")))
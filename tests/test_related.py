@@ -0,0 +1,101 @@
+# coding: utf-8
+from unittest import mock
+import json
+import unittest
+from siterefactorlib import related
+from siterefactorlib.related import RelatedPages
+
+WORDS = ["debian", "python", "music", "travel", "food", "linux", "packaging", "concert", "train", "pasta"]
+
+
+def fixture(count=30):
+    # Pages with overlapping tags and words
+    docs = {}
+    for i in range(count):
+        tags = sorted(set([WORDS[i % 3], WORDS[i % 4]]))
+        terms = sorted(set(WORDS[(i * 7 + k) % len(WORDS)] for k in range(3)) | {"page{}".format(i % 5)})
+        docs["blog/page{:02}.mdwn".format(i)] = (tags, terms)
+    return docs
+
+
+class TestRelated(unittest.TestCase):
+    def setUp(self):
+        try:
+            import numpy  # noqa: F401
+            import scipy  # noqa: F401
+        except ImportError:
+            self.skipTest("related pages need numpy and scipy")
+
+    def build(self, docs, cache=None):
+        res = RelatedPages(json.loads(json.dumps(cache)) if cache is not None else {})
+        res.build(docs)
+        return res
+
+    def assertSameRows(self, a, b):
+        self.assertEqual(sorted(a.rows), sorted(b.rows))
+        for relpath, (signature, row) in a.rows.items():
+            other = b.rows[relpath][1]
+            self.assertEqual([r for r, score in row], [r for r, score in other], relpath)
+            for (r, score), (r1, score1) in zip(row, other):
+                self.assertAlmostEqual(score, score1, places=6)
+
+    def test_unchanged(self):
+        docs = fixture()
+        first = self.build(docs)
+        self.assertEqual(first.count_computed, len(docs))
+        second = self.build(docs, first.to_cache())
+        self.assertEqual(second.count_computed, 0)
+        self.assertSameRows(first, second)
+
+    def test_incremental_matches_full(self):
+        docs = fixture()
+        first = self.build(docs)
+
+        # Change a page and remove another: with the default bound only some
+        # rows are recomputed, while with no drift allowed all rows are, and
+        # the result is the same as a full build
+        changed = dict(docs)
+        changed["blog/page03.mdwn"] = (["music"], ["music", "pasta", "page3"])
+        del changed["blog/page04.mdwn"]
+        partial = self.build(changed, first.to_cache())
+        self.assertLess(partial.count_computed, len(changed))
+        self.assertEqual(partial.builds, 1)
+        with mock.patch.object(related, "MAX_DF_DRIFT", 0):
+            bounded = self.build(changed, first.to_cache())
+        self.assertEqual(bounded.count_computed, len(changed))
+        self.assertEqual(bounded.builds, 0)
+
+        full = self.build(changed)
+        self.assertSameRows(bounded, full)
+
+        # The partial update only differs by the IDF weights of kept rows,
+        # and does not list removed pages
+        for relpath, (signature, row) in partial.rows.items():
+            self.assertEqual(set(r for r, score in row) - set(changed), set(), relpath)
+            for (r, score), (r1, score1) in zip(row, full.rows[relpath][1]):
+                self.assertAlmostEqual(score, score1, delta=0.05)
+
+    def test_drift(self):
+        docs = fixture()
+        first = self.build(docs)
+
+        # Rewriting most pages changes document frequencies too much
+        changed = {relpath: (tags, terms + ["new"]) for relpath, (tags, terms) in docs.items()}
+        changed["blog/page00.mdwn"] = docs["blog/page00.mdwn"]
+        second = self.build(changed, first.to_cache())
+        self.assertEqual(second.count_computed, len(changed))
+        self.assertSameRows(second, self.build(changed))
+
+    def test_max_builds(self):
+        docs = fixture()
+        cache = self.build(docs).to_cache()
+        for i in range(related.MAX_INCREMENTAL_BUILDS + 1):
+            docs = dict(docs)
+            docs["blog/extra.mdwn"] = (["debian"], ["debian", "word{}".format(i)])
+            res = self.build(docs, cache)
+            cache = res.to_cache()
+            if i < related.MAX_INCREMENTAL_BUILDS:
+                self.assertEqual(res.builds, i + 1)
+        self.assertEqual(res.builds, 0)
+        self.assertEqual(res.count_computed, len(docs))
+        self.assertSameRows(res, self.build(docs))
@@ -0,0 +1,85 @@
+# coding: utf-8
+import json
+import os
+import tempfile
+import unittest
+from conftest import write
+from siterefactorlib.core import load_site
+from siterefactorlib.search import SearchIndex, SHARD_PREFIX
+
+
+def decode(deltas):
+    # Decode delta-encoded postings, as search.js does
+    res = []
+    docid = 0
+    for delta in deltas:
+        docid += delta
+        res.append(docid)
+    return res
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex({})
+        docs = {
+            "c.mdwn": ["debian", "python", "zz"],
+            "a.mdwn": ["debian", "music"],
+            "b.mdwn": ["debian", "python"],
+            "d.mdwn": ["debian", "dessert"],
+        }
+        for relpath, terms in docs.items():
+            self.index.add_terms(relpath, relpath[0] + ".html", relpath[0].upper(), terms)
+        self.files = json.loads(json.dumps(self.index.build()))
+
+    def test_docs(self):
+        # Document ids are positions in docs.json, sorted by relpath
+        self.assertEqual(self.files["docs.json"], [["a.html", "A"], ["b.html", "B"], ["c.html", "C"], ["d.html", "D"]])
+
+    def test_shards(self):
+        # Each term is in the shard named after its first SHARD_PREFIX
+        # characters
+        self.assertEqual(SHARD_PREFIX, 2)
+        self.assertEqual(sorted(self.files), [
+            "docs.json", "shard-de.json", "shard-mu.json", "shard-py.json", "shard-zz.json"])
+        self.assertEqual(sorted(self.files["shard-de.json"]), ["debian", "dessert"])
+
+    def test_postings(self):
+        shard = self.files["shard-de.json"]
+        # Postings are delta-encoded
+        self.assertEqual(shard["debian"], [0, 1, 1, 1])
+        self.assertEqual(decode(shard["debian"]), [0, 1, 2, 3])
+        self.assertEqual(shard["dessert"], [3])
+        self.assertEqual(decode(self.files["shard-py.json"]["python"]), [1, 2])
+
+    def test_encode(self):
+        text = self.index.encode({"b": [1], "a": ["è"]})
+        self.assertEqual(text, '{"a":["è"],"b":[1]}')
+
+
+class TestWebSearch(unittest.TestCase):
+    def setUp(self):
+        try:
+            from siterefactorlib.web import WebWriter
+        except ImportError as e:
+            self.skipTest("web output not available: {}".format(e))
+        self.WebWriter = WebWriter
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(self.src, "tags"))
+        write(self.src, "blog/2015/post.mdwn", '[[!meta date="2015-03-01 10:00"]]\n# Post\n\nDebian text.\n')
+        self.root = os.path.join(self.workdir.name, "dest")
+        write(self.root, "templates/__page__.html", "<html><body>{{content}}</body></html>\n")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_search_index(self):
+        self.WebWriter(self.root).write(load_site(self.src))
+        search = os.path.join(self.root, "web", "search")
+        with open(os.path.join(search, "shard-de.json"), "rt") as fd:
+            self.assertEqual(json.load(fd), {"debian": [0]})
+
+        # Without the search index, the files of the previous build are
+        # removed
+        self.WebWriter(self.root, search_index=False).write(load_site(self.src))
+        self.assertFalse(os.path.exists(search))
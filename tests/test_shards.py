@@ -0,0 +1,89 @@
+# coding: utf-8
+import filecmp
+import os
+import tempfile
+import unittest
+from conftest import tree, write
+from siterefactorlib.core import load_site
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        try:
+            from siterefactorlib.web import WebWriter
+        except ImportError as e:
+            self.skipTest("web output not available: {}".format(e))
+        self.WebWriter = WebWriter
+
+        self.workdir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.workdir.name, "site")
+        write(self.src, "tags/debian.mdwn", "Posts about Debian.\n")
+        for i in range(12):
+            write(self.src, "blog/{}/post{}.mdwn".format(2010 + i % 3, i),
+                  '[[!meta date="{}-0{}-01 10:00"]]\n[[!tag tags/debian tags/t{}]]\n# Post {}\n\n'
+                  'Text of post {}, see [[post{}]].\n'.format(2010 + i % 3, 1 + i % 9, i % 2, i, i, (i + 1) % 12))
+        # Pages with no content only get a stub, but are listed in indices
+        write(self.src, "blog/2012/empty.mdwn", '[[!meta date="2012-12-01 10:00"]]\n[[!tag tags/debian]]\n')
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def build(self, name, runs=({},), **kw):
+        root = os.path.join(self.workdir.name, name)
+        write(root, "templates/__page__.html",
+              "<html><head><title>{{title}}</title></head><body>{{content}}</body></html>\n")
+        for args in runs:
+            writer = self.WebWriter(root, site_url="https://example.org/", **args, **kw)
+            writer.write(load_site(self.src))
+        return os.path.join(root, "web")
+
+    def assertSameTree(self, a, b):
+        files = tree(a)
+        self.assertEqual(tree(b), files)
+        match, mismatch, errors = filecmp.cmpfiles(a, b, files, shallow=False)
+        self.assertEqual(mismatch, [])
+        self.assertEqual(errors, [])
+
+    def test_merge_matches_full_build(self):
+        full = self.build("full")
+        merged = self.build("sharded", runs=[{"shard": (0, 2)}, {"shard": (1, 2)}, {"merge": 2}])
+
+        files = tree(full)
+        self.assertIn("tags/debian/index.html", files)
+        self.assertIn("archive/2012.html", files)
+        self.assertSameTree(full, merged)
+
+        # The page with no content is still in the indices
+        with open(os.path.join(merged, "archive", "2012.html"), "rt") as fd:
+            self.assertIn("empty", fd.read())
+
+    def test_resized_images(self):
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest("resizing images needs PIL")
+        from siterefactorlib.shards import shard_of
+        for i in range(4):
+            relpath = "blog/2010/img{}.png".format(i)
+            Image.new("RGB", (1000 + i, 500)).save(os.path.join(self.src, relpath))
+            write(self.src, "blog/2010/gallery{}.mdwn".format(i),
+                  '[[!meta date="2010-02-0{} 10:00"]]\n# Gallery {}\n\n[[!img img{}.png alt="Image"]]\n'.format(
+                      i + 1, i, i))
+
+        full = self.build("full", resize_images=True)
+        self.assertIn("blog/2010/img0-480w.png", tree(full))
+        merged = self.build("sharded", runs=[{"shard": (0, 2)}, {"shard": (1, 2)}, {"merge": 2}],
+                            resize_images=True)
+        self.assertSameTree(full, merged)
+
+        # Each shard only resized its own images
+        for index in range(2):
+            outdir = os.path.join(self.workdir.name, "sharded", "web.shard-{}".format(index))
+            for i in range(4):
+                relpath = "blog/2010/img{}-480w.png".format(i)
+                self.assertEqual(os.path.exists(os.path.join(outdir, relpath)),
+                                 shard_of("blog/2010/img{}.png".format(i), 2) == index)
+            cachedir = os.path.join(self.workdir.name, "sharded", "cache", "shard-{}".format(index), "images")
+            resized = [f for f in os.listdir(cachedir) if f.endswith("-480.png")]
+            owned = [i for i in range(4) if shard_of("blog/2010/img{}.png".format(i), 2) == index]
+            self.assertEqual(len(resized), len(owned))
@@ -0,0 +1,92 @@
+# coding: utf-8
+import os
+import re
+import tempfile
+import unittest
+import urllib.parse
+from conftest import read, write
+from siterefactorlib.core import load_site
+
+
+class TestTagPages(unittest.TestCase):
+    def setUp(self):
+        try:
+            from siterefactorlib.web import WebWriter
+        except ImportError as e:
+            self.skipTest("web output not available: {}".format(e))
+
+        self.workdir = tempfile.TemporaryDirectory()
+        src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(src, "tags"))
+        write(src, "blog/2015/post.mdwn",
+              '[[!meta date="2015-03-01 10:00"]]\n[[!tag tags/index tags/c# tags/why?]]\n# Post\n\nText.\n')
+        # A page with no content
+        write(src, "blog/2015/empty.mdwn", '[[!meta date="2015-04-01 10:00"]]\n[[!tag tags/c#]]\n')
+
+        self.root = os.path.join(self.workdir.name, "dest")
+        write(self.root, "templates/__page__.html", "<html><body>{{content}}</body></html>\n")
+        WebWriter(self.root, site_url="https://example.org/").write(load_site(src))
+        self.web = os.path.join(self.root, "web")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_tag_named_index(self):
+        # The tag cloud is not overwritten by the page of the tag "index"
+        self.assertIn('class="tagcloud"', read(self.web, "tags/index.html"))
+        self.assertIn('class="pagelist"', read(self.web, "tags/index/index.html"))
+
+    def test_quoted_urls(self):
+        cloud = read(self.web, "tags/index.html")
+        self.assertIn('href="c%23/index.html"', cloud)
+        self.assertIn('href="why%3F/index.html"', cloud)
+        self.assertIn('href="index/index.html"', cloud)
+        self.assertIn('href="../../blog/2015/post.html"', read(self.web, "tags/c#/index.html"))
+        self.assertIn('href="https://example.org/tags/c%23.atom"', read(self.web, "tags/c#.atom"))
+
+    def test_links_resolve(self):
+        # Every link in the index pages points to a file that exists,
+        # including the stub of the page with no content
+        for relpath in ("tags/index.html", "tags/c#/index.html", "archive/index.html", "archive/2015.html"):
+            text = read(self.web, relpath)
+            links = re.findall(r'href="([^"]+)"', text)
+            self.assertTrue(links, relpath)
+            for link in links:
+                target = os.path.join(self.web, os.path.dirname(relpath), urllib.parse.unquote(link))
+                self.assertTrue(os.path.isfile(target), "{} links to missing {}".format(relpath, link))
+        self.assertIn("empty.html", read(self.web, "tags/c#/index.html"))
+
+
+class TestFeeds(unittest.TestCase):
+    def setUp(self):
+        try:
+            from siterefactorlib.web import WebWriter
+        except ImportError as e:
+            self.skipTest("web output not available: {}".format(e))
+
+        self.workdir = tempfile.TemporaryDirectory()
+        src = os.path.join(self.workdir.name, "site")
+        os.makedirs(os.path.join(src, "tags"))
+        write(src, "blog/2015/new.mdwn", '[[!meta date="2015-06-01T10:00:00+00:00"]]\n# New\n\nText.\n')
+        write(src, "blog/2014/old.mdwn",
+              '[[!meta date="2014-03-01T10:00:00+00:00"]]\n[[!tag tags/old]]\n# Old\n\nText.\n')
+        write(src, "blog/2013/empty.mdwn", '[[!meta date="2013-03-01T10:00:00+00:00"]]\n[[!tag tags/empty]]\n')
+
+        root = os.path.join(self.workdir.name, "dest")
+        write(root, "templates/__page__.html", "<html><body>{{content}}</body></html>\n")
+        WebWriter(root, site_url="https://example.org/").write(load_site(src))
+        self.web = os.path.join(root, "web")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def updated(self, relpath):
+        return re.search(r"<feed.*?<updated>(.*?)</updated>", read(self.web, relpath), re.S).group(1)
+
+    def test_updated(self):
+        self.assertEqual(self.updated("index.atom"), "2015-06-01T10:00:00+00:00")
+        # Tag feeds are dated with their newest page, also when it has no
+        # content to make an entry
+        self.assertEqual(self.updated("tags/old.atom"), "2014-03-01T10:00:00+00:00")
+        self.assertEqual(self.updated("tags/empty.atom"), "2013-03-01T10:00:00+00:00")
+        self.assertNotIn("<entry", read(self.web, "tags/empty.atom"))